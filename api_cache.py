@@ -0,0 +1,123 @@
+"""
+Read-through disk cache for plant API responses (perenual_jsons/, trefle_jsons/).
+
+Responses stay in the same per-query json files the API helpers always wrote. The cache adds an
+index.json per directory recording when each entry was fetched, last used and how big it is, so
+lookups never list or stat the directory. Entries older than the TTL are refetched, and the least
+recently used ones are dropped once the directory goes over its entry or byte cap.
+"""
+
+import os
+import re
+import json
+import time
+import atexit
+import threading
+from collections import OrderedDict
+
+DEFAULT_TTL = float(os.environ.get('SAKURA_API_CACHE_TTL', str(30 * 24 * 3600)))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('SAKURA_API_CACHE_MAX_ENTRIES', '5000'))
+DEFAULT_MAX_BYTES = int(os.environ.get('SAKURA_API_CACHE_MAX_BYTES', str(100 * 1024 * 1024)))
+INDEX_FLUSH_INTERVAL = 30  # seconds, last-used times are only needed for eviction order
+
+
+def normalize_query(query: str):
+    return ' '.join(query.lower().split())
+
+def query_filename(query: str):
+    # Same names perenual_query_api has always written, minus characters that aren't path safe
+    return re.sub(r'[^a-z0-9]+', '_', normalize_query(query)).strip('_')
+
+
+class QueryCache:
+    def __init__(self, directory, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.index_path = os.path.join(directory, 'index.json')
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = None  # key -> {'file', 'fetched', 'used', 'size'}, least recently used first
+        self.total_bytes = 0
+        self.dirty_since = None
+        self.hits = 0
+        self.misses = 0
+        atexit.register(self.flush)
+
+    def _load(self):
+        if self.entries is not None:
+            return
+        entries = {}
+        if os.path.exists(self.index_path):
+            try:
+                with open(self.index_path, 'r') as file:
+                    entries = json.load(file)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable API cache index {self.index_path}: {e}")
+        self.entries = OrderedDict(sorted(entries.items(), key=lambda item: item[1]['used']))
+        self.total_bytes = sum(entry['size'] for entry in self.entries.values())
+
+    def get(self, key):
+        """The cached response for key, or None when it is missing or past its TTL."""
+        with self.lock:
+            self._load()
+            entry = self.entries.get(key)
+            now = time.time()
+            if entry is None or now - entry['fetched'] > self.ttl:
+                self.misses += 1
+                return None
+            try:
+                with open(os.path.join(self.directory, entry['file']), 'r') as file:
+                    data = json.load(file)
+            except (OSError, ValueError):
+                self._drop(key)
+                self.misses += 1
+                return None
+            entry['used'] = now
+            self.entries.move_to_end(key)
+            self._mark_dirty(now)
+            self.hits += 1
+            return data
+
+    def put(self, key, data, filename):
+        body = json.dumps(data, indent=4)
+        with self.lock:
+            self._load()
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, filename), 'w') as file:
+                file.write(body)
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)['size']
+            now = time.time()
+            self.entries[key] = {'file': filename, 'fetched': now, 'used': now, 'size': len(body)}
+            self.total_bytes += len(body)
+            while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                self._drop(next(iter(self.entries)), delete_file=True)
+            self._write_index()
+
+    def _drop(self, key, delete_file=False):
+        entry = self.entries.pop(key)
+        self.total_bytes -= entry['size']
+        if delete_file and not any(other['file'] == entry['file'] for other in self.entries.values()):
+            try:
+                os.remove(os.path.join(self.directory, entry['file']))
+            except OSError:
+                pass
+
+    def _mark_dirty(self, now):
+        if self.dirty_since is None:
+            self.dirty_since = now
+        elif now - self.dirty_since > INDEX_FLUSH_INTERVAL:
+            self._write_index()
+
+    def _write_index(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(self.entries, file)
+        os.replace(tmp_path, self.index_path)
+        self.dirty_since = None
+
+    def flush(self):
+        with self.lock:
+            if self.entries is not None and self.dirty_since is not None and os.path.isdir(self.directory):
+                self._write_index()
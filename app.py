@@ -2,13 +2,29 @@
 This defines the Flask scripting for the Sakura front-end
 """
 
+import io
+import csv
 import json
-from dash.dependencies import Input, Output
-from dash import html, State, Dash, dcc
-from datetime import datetime, timedelta
-from flask import Flask, render_template, request, redirect, url_for
+import time
+import pstats
+import cProfile
+import hashlib
+import threading
+from datetime import date, datetime, timedelta
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, make_response, g, stream_with_context
+from markupsafe import Markup
 
-from backend import read_from_s3, read_local_plant_data, write_to_s3, perenual_query_api as query_api
+from storage import get_storage, plant_label, PLANT_FIELDS
+from records import PlantCare
+from catalog import lookup_watering as catalog_watering
+from species_lookup import find_watering, perenual_msg
+from api_cache import normalize_query
+from bulk_import import parse_bulk_payload, resolve_watering_many
+from schedule import NO_WATERING, EVENT_KINDS, EventIndex
+from reminders import ReminderScheduler, REMINDER_MODE, compute_due_lists, load_due_lists
+from export import CALENDAR_FIELDS, care_calendar, ndjson_lines, csv_lines, ical_lines
+from metrics import (span, registry, render_prometheus, start_request_profile, finish_request_profile,
+                     server_timing, PROFILE_HEADER, PROFILING)
 
 # Include external stylesheets - assuming 'styles.css' is accessible at the root of your web server
 external_stylesheets = [
@@ -18,55 +34,104 @@ external_stylesheets = [
 
 app = Flask(__name__)
 app.config['DEBUG'] = True
-dash_app = Dash(
-    __name__, server=app,
-    external_stylesheets=external_stylesheets,
-    url_base_pathname='/dashboard/'
-    )
 
-def read_plants_data():
-    #return read_local_plant_data()
-    return read_from_s3()
+@app.before_request
+def start_request_timing():
+    g.request_start = time.perf_counter()
+    profile = request.headers.get(PROFILE_HEADER) if PROFILING else None
+    if profile:
+        g.profile_token = start_request_profile()
+        if profile == 'cprofile':
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
 
-def write_plants_data(data):
-    #with open('plants.json', 'w') as file:
-    #    json.dump({'plants': data}, file, indent=4)
-    write_to_s3(data)
+@app.after_request
+def finish_request_timing(response):
+    registry.observe('sakura_request_seconds', (('endpoint', request.endpoint or 'unmatched'),),
+                     time.perf_counter() - g.request_start)
+    if 'profile_token' not in g:
+        return response
+    spans = finish_request_profile(g.pop('profile_token'))
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # The report replaces the page: the 20 most expensive calls by cumulative time
+        profiler.disable()
+        report = io.StringIO()
+        pstats.Stats(profiler, stream=report).sort_stats('cumulative').print_stats(20)
+        response = make_response(report.getvalue(), 200, {'Content-Type': 'text/plain; charset=utf-8'})
+    spans.append(('total', time.perf_counter() - g.request_start))
+    response.headers['Server-Timing'] = server_timing(spans)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus scrape target: span and request histograms plus the plant API client counters
+    return render_prometheus(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+def add_plant_data(plant):
+    # The engine allocates the id in the same write that stores the plant, so concurrent adds
+    # (other threads or gunicorn workers) can neither lose each other's plants nor share an id.
+    plant_id = get_storage().add(plant)
+    event_index.upsert(plant)
+    notify_reminders()
+    return plant_id
+
+def add_many_plant_data(plants):
+    plant_ids = get_storage().add_many(plants)
+    for plant in plants:
+        event_index.upsert(plant)
+    notify_reminders()
+    return plant_ids
 
 
 def update_plant_data(plant_id, updates):
-    plants_data = read_plants_data()
-    for plant in plants_data:
-        if plant['id'] == plant_id:
-            plant.update(updates)
-            break
-    write_plants_data(plants_data)
-
-@dash_app.callback(
-    [Output('name-input', 'value'),
-     Output('position-input', 'value'),
-     Output('frequency-input', 'value'),
-     Output('food-schedule-input', 'value'),
-     Output('repotting-schedule-input', 'value')],
-    [Input('plant-dropdown', 'value')]
-)
+    if get_storage().update(plant_id, updates):
+        event_index.update(plant_id, updates)
+        notify_reminders()
+
+def update_many_plant_data(changes):
+    # {plant id: updates}, stored in a single write; returns the ids that existed
+    updated = get_storage().update_many(changes)
+    for plant_id in updated:
+        event_index.update(plant_id, changes[plant_id])
+    if updated:
+        notify_reminders()
+    return updated
+
+EDITABLE_FIELDS = ('name', 'position', 'water_schedule', 'food_schedule', 'repotting_schedule')
+INTEGER_FIELDS = ('position', 'water_schedule', 'food_schedule', 'repotting_schedule')
+
+def clean_plant_updates(values, skip_blank=False):
+    """
+    Sanitizes edited values the way the dashboard form always has: integer fields go through int()
+    and blank ones become 0, or are left out with skip_blank (bulk edits only change what was
+    filled in). Names have to be text and positions one of the four panels. Returns (updates, error
+    message or None).
+    """
+    updates = {}
+    for field, value in values.items():
+        if skip_blank and value in (None, ''):
+            continue
+        if field in INTEGER_FIELDS:
+            try:
+                value = int(value) if value else 0
+            except (TypeError, ValueError):
+                return None, "Please enter valid integer values for schedules and position."
+        if field == 'position' and value not in range(4):
+            return None, "Position must be between 0 and 3."
+        if field == 'name' and not isinstance(value, str):
+            return None, "The name must be text."
+        updates[field] = value
+    return updates, None
+
+# Dashboard callbacks, wired to their inputs and outputs in create_dashboard()
 def update_input_values(plant_id):
-    plants_data = read_plants_data()
     if plant_id is not None:
-        plant = next((p for p in plants_data if p['id'] == plant_id), None)
+        plant = get_storage().get(plant_id)
         if plant:
             return plant['name'], plant['position'], plant['water_schedule'], plant['food_schedule'], plant['repotting_schedule']
     return '', '', '', '', ''
 
-@dash_app.callback(
-    Output('update-output', 'children'),
-    Input('update-button', 'n_clicks'),
-    [State('plant-dropdown', 'value'),
-     State('name-input', 'value'),
-     State('position-input', 'value'),
-     State('frequency-input', 'value'),
-     State('food-schedule-input', 'value'),
-     State('repotting-schedule-input', 'value')])
 def update_plant_info( # Callback to update plant info from plotly dash form
     n_clicks, plant_id, name, position,
     water_schedule, food_schedule, repotting_schedule
@@ -75,121 +140,281 @@ def update_plant_info( # Callback to update plant info from plotly dash form
         return ''
 
     # Sanitize input values to ensure they are integers
-    try:
-        position = int(position) if position else 0
-        water_schedule = int(water_schedule) if water_schedule else 0
-        food_schedule = int(food_schedule) if food_schedule else 0
-        repotting_schedule = int(repotting_schedule) if repotting_schedule else 0
-    except ValueError:
-        return "Please enter valid integer values for schedules and position."
-
-    new_data = {
+    new_data, error = clean_plant_updates({
         'name': name,
         'position': position,
         'water_schedule': water_schedule,
         'food_schedule': food_schedule,
         'repotting_schedule': repotting_schedule
-    }
+    })
+    if error:
+        return error
     update_plant_data(plant_id, new_data)
     return f"Updated plant {plant_id} with new details."
 
-dash_app.layout = html.Div([ # Defines the form for updating details of plant data:
-    dcc.Dropdown(
-        id='plant-dropdown',
-        options=[{'label': f"ID: {plant['id']}, {plant['name']}", 'value': plant['id']} 
-                 for plant in read_plants_data()],
-        placeholder="Select a plant", style={'width': '730px', 'paddingBottom': '5px'}
-    ),
-    html.Div([
-        dcc.Input(id='name-input', type='text', placeholder='Enter plant name', style={'width': '200px'}),
-        html.Label('Plant Name', htmlFor='name-input', style={'paddingLeft': '5px'})
-    ]),
-    html.Div([
-        dcc.Input(id='position-input', type='number', placeholder='Enter new position', style={'width': '200px'}),
-        html.Label('Position (0=Front Yard, 1=Inside-Sunlight, 2=Inside-Lowlight, 3=Backyard)',
-                   htmlFor='position-input', style={'paddingLeft': '5px'})
-    ]),
-    html.Div([
-        dcc.Input(id='frequency-input', type='number', placeholder='Enter watering frequency', style={'width': '200px'}),
-        html.Label('Watering Frequency (Days)', htmlFor='frequency-input', style={'paddingLeft': '5px'})
-    ]),
-    html.Div([
-        dcc.Input(id='food-schedule-input', type='number', placeholder='Enter food schedule', style={'width': '200px'}),
-        html.Label('Food Schedule (Months)', htmlFor='food-schedule-input', style={'paddingLeft': '5px'})
-    ]),
-    html.Div([
-        dcc.Input(id='repotting-schedule-input', type='number', placeholder='Enter repotting schedule', style={'width': '200px'}),
-        html.Label('Repotting Schedule (Months)', htmlFor='repotting-schedule-input', style={'paddingLeft': '5px'})
-    ]),
-    html.Div(
-        html.Button('Update Plant Info', id='update-button',
-            style={
-                'backgroundColor': '#007bff',  # Use a specific color code if needed
-                'color': 'white',
-                'border': 'none',
-                'width': '200px',
-                'height': '40px'
-                }
+# Plants offered in the dropdown at a time, typing searches the whole collection on the server
+DROPDOWN_LIMIT = 50
+
+def update_dropdown_options(search_value, plant_id):
+    plants = get_storage().search(search_value or '', limit=DROPDOWN_LIMIT)
+    if plant_id is not None and all(plant['id'] != plant_id for plant in plants):
+        selected = get_storage().get(plant_id)  # keep the current selection selectable
+        if selected:
+            plants.insert(0, selected)
+    return [{'label': plant_label(plant), 'value': plant['id']} for plant in plants]
+
+def select_plant_ids(plant_ids=None, position=None):
+    # The chosen plants plus, when a position is given, every plant at that position
+    selected = [int(plant_id) for plant_id in plant_ids or []]
+    if position not in (None, ''):
+        position = int(position)
+        selected += [plant['id'] for plant in get_storage().by_positions([position])[position]]
+    return list(dict.fromkeys(selected))
+
+def bulk_update_plants_info( # Callback of the bulk edit form: the same changes for many plants
+    n_clicks, plant_ids, position_filter,
+    position, water_schedule, food_schedule, repotting_schedule
+    ):
+    if n_clicks is None:
+        return ''
+
+    updates, error = clean_plant_updates({
+        'position': position,
+        'water_schedule': water_schedule,
+        'food_schedule': food_schedule,
+        'repotting_schedule': repotting_schedule
+    }, skip_blank=True)
+    if error:
+        return error
+    if not updates:
+        return "Fill in the fields to change, blank ones are left as they are."
+    plant_ids = select_plant_ids(plant_ids, position_filter)
+    if not plant_ids:
+        return "Select some plants or a position first."
+    updated = update_many_plant_data({plant_id: dict(updates) for plant_id in plant_ids})
+    changed = ', '.join(f"{field}={value}" for field, value in updates.items())
+    return f"Updated {len(updated)} plants with {changed}."
+
+def update_bulk_dropdown_options(search_value, plant_ids):
+    plants = get_storage().search(search_value or '', limit=DROPDOWN_LIMIT)
+    shown = {plant['id'] for plant in plants}
+    for plant_id in plant_ids or []:  # selected plants must stay in the options
+        if plant_id not in shown:
+            selected = get_storage().get(plant_id)
+            if selected:
+                plants.insert(0, selected)
+    return [{'label': plant_label(plant), 'value': plant['id']} for plant in plants]
+
+def serve_layout():
+    # Built per page load (not at import) so new plants show up; options come from update_dropdown_options
+    from dash import html, dcc
+
+    return html.Div([ # Defines the form for updating details of plant data:
+        dcc.Dropdown(
+            id='plant-dropdown',
+            options=[],
+            placeholder=f"Select a plant (type to search, first {DROPDOWN_LIMIT} shown)",
+            style={'width': '730px', 'paddingBottom': '5px'}
+        ),
+        html.Div([
+            dcc.Input(id='name-input', type='text', placeholder='Enter plant name', style={'width': '200px'}),
+            html.Label('Plant Name', htmlFor='name-input', style={'paddingLeft': '5px'})
+        ]),
+        html.Div([
+            dcc.Input(id='position-input', type='number', placeholder='Enter new position', style={'width': '200px'}),
+            html.Label('Position (0=Front Yard, 1=Inside-Sunlight, 2=Inside-Lowlight, 3=Backyard)',
+                       htmlFor='position-input', style={'paddingLeft': '5px'})
+        ]),
+        html.Div([
+            dcc.Input(id='frequency-input', type='number', placeholder='Enter watering frequency', style={'width': '200px'}),
+            html.Label('Watering Frequency (Days)', htmlFor='frequency-input', style={'paddingLeft': '5px'})
+        ]),
+        html.Div([
+            dcc.Input(id='food-schedule-input', type='number', placeholder='Enter food schedule', style={'width': '200px'}),
+            html.Label('Food Schedule (Months)', htmlFor='food-schedule-input', style={'paddingLeft': '5px'})
+        ]),
+        html.Div([
+            dcc.Input(id='repotting-schedule-input', type='number', placeholder='Enter repotting schedule', style={'width': '200px'}),
+            html.Label('Repotting Schedule (Months)', htmlFor='repotting-schedule-input', style={'paddingLeft': '5px'})
+        ]),
+        html.Div(
+            html.Button('Update Plant Info', id='update-button',
+                style={
+                    'backgroundColor': '#007bff',  # Use a specific color code if needed
+                    'color': 'white',
+                    'border': 'none',
+                    'width': '200px',
+                    'height': '40px'
+                    }
+            )
+        ),
+        html.Div(id='update-output'),
+
+        # Bulk edit: filled-in fields are applied to every selected plant and/or position
+        html.Hr(),
+        html.H5('Edit Many Plants'),
+        dcc.Dropdown(
+            id='bulk-plant-dropdown',
+            options=[],
+            multi=True,
+            placeholder="Select plants (type to search)",
+            style={'width': '730px', 'paddingBottom': '5px'}
+        ),
+        dcc.Dropdown(
+            id='bulk-position-dropdown',
+            options=[{'label': f"Every plant in {panel['title']}", 'value': position} for position, panel in PANELS.items()],
+            placeholder="...and/or every plant in a position",
+            style={'width': '730px', 'paddingBottom': '5px'}
+        ),
+        html.Div([
+            dcc.Input(id='bulk-position-input', type='number', placeholder='Leave blank to keep', style={'width': '200px'}),
+            html.Label('Move to Position', htmlFor='bulk-position-input', style={'paddingLeft': '5px'})
+        ]),
+        html.Div([
+            dcc.Input(id='bulk-frequency-input', type='number', placeholder='Leave blank to keep', style={'width': '200px'}),
+            html.Label('Watering Frequency (Days)', htmlFor='bulk-frequency-input', style={'paddingLeft': '5px'})
+        ]),
+        html.Div([
+            dcc.Input(id='bulk-food-schedule-input', type='number', placeholder='Leave blank to keep', style={'width': '200px'}),
+            html.Label('Food Schedule (Months)', htmlFor='bulk-food-schedule-input', style={'paddingLeft': '5px'})
+        ]),
+        html.Div([
+            dcc.Input(id='bulk-repotting-schedule-input', type='number', placeholder='Leave blank to keep', style={'width': '200px'}),
+            html.Label('Repotting Schedule (Months)', htmlFor='bulk-repotting-schedule-input', style={'paddingLeft': '5px'})
+        ]),
+        html.Div(
+            html.Button('Update Selected Plants', id='bulk-update-button',
+                style={
+                    'backgroundColor': '#007bff',
+                    'color': 'white',
+                    'border': 'none',
+                    'width': '200px',
+                    'height': '40px'
+                    }
+            )
+        ),
+        html.Div(id='bulk-update-output')
+    ], style={'backgroundColor': 'rgb(105, 174, 105)', 'padding': '20px', 'height': '100vh'})
+
+def create_dashboard():
+    """
+    Builds the Dash sub-app for /dashboard/ on its own Flask server. Importing dash is the slowest
+    part of startup, so this only happens when the first dashboard request comes in.
+    """
+    from dash import Dash, Input, Output, State
+
+    dash_app = Dash(
+        __name__,
+        external_stylesheets=external_stylesheets,
+        url_base_pathname='/dashboard/'
         )
-    ),
-    html.Div(id='update-output')
-], style={'backgroundColor': 'rgb(105, 174, 105)', 'padding': '20px', 'height': '100vh'})
-
-
-TODAY = datetime.today()
-TOMORROW = TODAY + timedelta(days=1)
-perenual_msg = "Upgrade Plans To Premium/Supreme - https://perenual.com/subscription-api-pricing. I'm sorry"
-
-
-def get_next_plant_id(data):
-    return max([plant.get('id', 0) for plant in data] + [0]) + 1
-
-# Assuming your schedules are integers representing days for water and months for food/repotting
-def calculate_next_water_date(date_added, water_schedule):
-    date_added = datetime.strptime(date_added, "%Y-%m-%d")
-    days_since_added = (TODAY - date_added).days
-    days_until_next_water = water_schedule - (days_since_added % water_schedule)
-    return (TODAY + timedelta(days=days_until_next_water)).strftime("%Y-%m-%d")
-
-def is_event_today_or_tomorrow(date_added, schedule, unit):
-    if schedule == 0:
-        return False
-    date_added = datetime.strptime(date_added, "%Y-%m-%d")
-    if unit == 'days':
-        period = timedelta(days=schedule)
-    elif unit == 'months':
-        period = timedelta(days=schedule*30) # Approximation
-    next_event_date = date_added
-    while next_event_date < TODAY:
-        next_event_date += period
-    return next_event_date <= (TODAY + timedelta(days=1))
-
-def get_watering(query: str):
-    plants = query_api(query)
-
-    if len(plants) == 1:
-        return plants[0]['watering']
-    if len(plants) == 0:
-        print(f"Got no result back from perenual API with query: '{query}'")
-        return "NOPE"
-    if len(plants) > 10:
-        print(f"Got {len(plants)} results back from perenual API, please narrow your query.")
-        return "NOPE"
-    if len(plants) > 1: # Just use the first one that is valid for now:
-        for plant in plants:
-            if plant['watering'] != perenual_msg:
-                return plant['watering']
-        return perenual_msg
+    dash_app.callback(
+        [Output('name-input', 'value'),
+         Output('position-input', 'value'),
+         Output('frequency-input', 'value'),
+         Output('food-schedule-input', 'value'),
+         Output('repotting-schedule-input', 'value')],
+        [Input('plant-dropdown', 'value')]
+    )(update_input_values)
+    dash_app.callback(
+        Output('update-output', 'children'),
+        Input('update-button', 'n_clicks'),
+        [State('plant-dropdown', 'value'),
+         State('name-input', 'value'),
+         State('position-input', 'value'),
+         State('frequency-input', 'value'),
+         State('food-schedule-input', 'value'),
+         State('repotting-schedule-input', 'value')]
+    )(update_plant_info)
+    dash_app.callback(
+        Output('plant-dropdown', 'options'),
+        Input('plant-dropdown', 'search_value'),
+        State('plant-dropdown', 'value')
+    )(update_dropdown_options)
+    dash_app.callback(
+        Output('bulk-update-output', 'children'),
+        Input('bulk-update-button', 'n_clicks'),
+        [State('bulk-plant-dropdown', 'value'),
+         State('bulk-position-dropdown', 'value'),
+         State('bulk-position-input', 'value'),
+         State('bulk-frequency-input', 'value'),
+         State('bulk-food-schedule-input', 'value'),
+         State('bulk-repotting-schedule-input', 'value')]
+    )(bulk_update_plants_info)
+    dash_app.callback(
+        Output('bulk-plant-dropdown', 'options'),
+        Input('bulk-plant-dropdown', 'search_value'),
+        State('bulk-plant-dropdown', 'value')
+    )(update_bulk_dropdown_options)
+    dash_app.layout = serve_layout
+    return dash_app
 
+class LazyDashboard:
+    """WSGI middleware sending /dashboard requests to the Dash app, created by the first of them."""
+    def __init__(self, wsgi_app, prefix, factory):
+        self.wsgi_app = wsgi_app
+        self.prefix = prefix
+        self.factory = factory
+        self.dashboard = None
+        self.lock = threading.Lock()
 
-@app.route('/add-plant', methods=['POST'])
-def add_plant():
-    plant_name = request.form['plant_name']
-    position = int(request.form['position'])
+    def get_dashboard(self):
+        with self.lock:
+            if self.dashboard is None:
+                self.dashboard = self.factory()
+            return self.dashboard
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if path == self.prefix or path.startswith(self.prefix + '/'):
+            return self.get_dashboard().server(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = LazyDashboard(app.wsgi_app, '/dashboard', create_dashboard)
+
+
+# Dates are always taken per call: a server that stays up past midnight must not keep showing
+# yesterday's schedule.
+event_index = EventIndex()
+# Due lists for /reminders, kept up to date by a background thread unless a separate worker
+# (python reminders.py) does it
+reminder_scheduler = ReminderScheduler(get_storage, index=event_index) if REMINDER_MODE == 'thread' else None
+
+@app.before_request
+def start_reminders():
+    # Started with the first request rather than at import, which keeps imports side-effect free
+    if reminder_scheduler is not None and reminder_scheduler.thread is None:
+        reminder_scheduler.start()
+
+def notify_reminders():
+    if reminder_scheduler is not None:
+        reminder_scheduler.trigger()
+
+@app.route('/reminders')
+def reminders():
+    """Today's saved due lists per position, computed on the spot if nothing current was saved."""
+    today = date.today()
+    due_lists = load_due_lists()
+    if due_lists is None or due_lists['date'] != today.isoformat():
+        storage = get_storage()
+        due_lists = compute_due_lists(storage.read_all() or [], today, event_index, storage.version())
+        notify_reminders()
+    position = request.args.get('position')
+    if position is not None:
+        due_lists = {**due_lists, 'positions': {position: due_lists['positions'].get(position, [])}}
+    return jsonify(due_lists)
+
+def get_watering(query: str, retryable_errors=False):
+    # The offline catalog (python catalog.py harvest) answers most queries without the API
+    watering = catalog_watering(query)
+    if watering is not None:
+        return watering
+    # Otherwise Perenual and Trefle are asked in parallel, see species_lookup.py
+    return find_watering(query, retryable_errors)
+
+def new_plant_record(plant_name, position, water_schedule, temperature_min=None, temperature_max=None):
+    # Turns the watering class from get_watering into the schedules for a plant at this position
     date_added = datetime.now().strftime("%Y-%m-%d")
-    water_schedule = get_watering(plant_name)
-    if water_schedule == "NOPE":
-        return redirect(url_for('home'))
     if water_schedule == perenual_msg:
         print("Perenual charges for subscription to view this plant's data, look it up and replace it!")
         water_schedule = "Average"
@@ -203,7 +428,7 @@ def add_plant():
         elif water_schedule == "Minimum":
             water_schedule = 10
         elif water_schedule == "None":
-            water_schedule = 9999
+            water_schedule = NO_WATERING
     else:
         repotting_schedule = 0
         if water_schedule == "Average":
@@ -213,17 +438,13 @@ def add_plant():
         elif water_schedule == "Minimum":
             water_schedule = 7
         elif water_schedule == "None":
-            water_schedule = 9999
+            water_schedule = NO_WATERING
     # Check water_schedule to confirm it is now an int:
     if type(water_schedule) != int:
         raise ValueError(f"Water schedule is not an int??: {water_schedule}")
-    temperature_min = request.form.get('temperature_min', None)
-    temperature_max = request.form.get('temperature_max', None)
-    
-    plants_data = read_plants_data()
-    plant_id = get_next_plant_id(plants_data)
-    plant_data = {
-        "id": plant_id,
+
+    return {
+        "id": None, # Allocated by add_plant_data
         "position": position,
         "name": plant_name,
         "date_added": date_added,
@@ -233,32 +454,309 @@ def add_plant():
         "temperature_min": temperature_min,
         "temperature_max": temperature_max
     }
+
+
+@app.route('/add-plant', methods=['POST'])
+def add_plant():
+    plant_name = request.form['plant_name']
+    position = int(request.form['position'])
+    water_schedule = get_watering(plant_name)
+    if water_schedule == "NOPE":
+        return redirect(url_for('home'))
+    temperature_min = request.form.get('temperature_min', None)
+    temperature_max = request.form.get('temperature_max', None)
     
-    plants_data.append(plant_data)
-    write_plants_data(plants_data)
+    plant_data = new_plant_record(plant_name, position, water_schedule, temperature_min, temperature_max)
+    add_plant_data(plant_data)
     
     return redirect(url_for('home'))
 
+@app.route('/bulk-import', methods=['POST'])
+def bulk_import():
+    """
+    Adds many plants at once from an uploaded file (form field "file") or the request body: JSON
+    [{"name": ..., "position": ...}] or CSV with a name,position header. A "position" form/query
+    value is used for rows without one. Watering for all names is looked up concurrently and every
+    plant is stored in a single write; rows that can't be resolved are reported back, not added.
+    """
+    upload = request.files.get('file')
+    text = upload.read().decode('utf-8') if upload else request.get_data(as_text=True)
+    default_position = request.values.get('position')
+    try:
+        rows, skipped = parse_bulk_payload(text, upload.filename if upload else '', default_position)
+    except (ValueError, KeyError, csv.Error) as e:
+        return jsonify({'error': f"Could not read the import: {e}"}), 400
+
+    waterings = resolve_watering_many(
+        [row['name'] for row in rows],
+        lambda name: get_watering(name, retryable_errors=True),
+        local_lookup=catalog_watering)
+    plants = []
+    for row in rows:
+        water_schedule = waterings[normalize_query(row['name'])]
+        if isinstance(water_schedule, Exception):
+            skipped.append({'name': row['name'], 'reason': str(water_schedule)})
+        elif water_schedule == "NOPE":
+            skipped.append({'name': row['name'], 'reason': "no unique match in the plant database"})
+        else:
+            try:
+                plants.append(new_plant_record(row['name'], row['position'], water_schedule))
+            except ValueError as e:
+                skipped.append({'name': row['name'], 'reason': str(e)})
+
+    if plants:
+        add_many_plant_data(plants)
+    added = [{'id': plant['id'], 'name': plant['name'], 'position': plant['position'],
+              'water_schedule': plant['water_schedule']} for plant in plants]
+    return jsonify({'added': added, 'skipped': skipped})
+
+@app.route('/plants/batch-update', methods=['POST'])
+def batch_update():
+    """
+    Edits many plants in a single write. JSON body: {"set": {field: value}, "ids": [...],
+    "position": n} gives the listed plants and/or every plant at position n the same values,
+    {"changes": {"<id>": {field: value}}} gives each plant its own; both can be combined. Editable
+    fields and their validation are the dashboard form's.
+    """
+    def checked_updates(values):
+        if not isinstance(values, dict) or not values:
+            raise ValueError("Updates must be a non-empty object of field: value")
+        unknown = set(values) - set(EDITABLE_FIELDS)
+        if unknown:
+            raise ValueError(f"Fields that can't be edited: {', '.join(sorted(unknown))}")
+        updates, error = clean_plant_updates(values, skip_blank=True)
+        if error:
+            raise ValueError(error)
+        return updates
+
+    def as_int(value, what):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"{what} must be an integer, got {json.dumps(value)}")
+
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return jsonify({'error': "Expected a JSON object"}), 400
+    if not isinstance(body.get('ids', []), list):
+        return jsonify({'error': "ids must be a list of plant ids"}), 400
+    if not isinstance(body.get('changes') or {}, dict):
+        return jsonify({'error': 'changes must be an object of {"<id>": {field: value}}'}), 400
+    changes = {}
+    try:
+        # Only our own messages get to the client, every ValueError here is raised with one
+        if 'set' in body:
+            updates = checked_updates(body['set'])
+            plant_ids = [as_int(plant_id, "Plant ids") for plant_id in body.get('ids') or []]
+            position = body.get('position')
+            if position not in (None, ''):
+                position = as_int(position, "position")
+                if position not in range(4):
+                    raise ValueError("position must be between 0 and 3")
+            for plant_id in select_plant_ids(plant_ids, position):
+                changes[plant_id] = dict(updates)
+        for plant_id, updates in (body.get('changes') or {}).items():
+            changes.setdefault(as_int(plant_id, "Plant ids in changes"), {}).update(checked_updates(updates))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    if not changes:
+        return jsonify({'error': "No plants selected"}), 400
+
+    updated = update_many_plant_data(changes)
+    return jsonify({'updated': sorted(updated), 'missing': sorted(set(changes) - set(updated))})
+
+# Panels of the home page by position, rendered from templates/panel.html
+PANELS = {
+    0: {'title': "Front Yard", 'table_id': 'frontyard-plant-table',
+        'color': 'rgb(105, 174, 105)', 'height_class': 'full-height-panel'},
+    1: {'title': "Inside (Sunlight)", 'table_id': 'isl-plant-table',
+        'color': 'rgb(255, 255, 124)', 'height_class': 'half-height-panel'},
+    2: {'title': "Inside (Low-light)", 'table_id': 'ill-plant-table',
+        'color': 'rgb(255, 183, 197)', 'height_class': 'half-height-panel'},
+    3: {'title': "Back Yard", 'table_id': 'backyard-plant-table',
+        'color': 'rgb(105, 174, 105)', 'height_class': 'full-height-panel'},
+}
+# Rendered HTML kept between requests: the whole page for one (data version, day), and each panel
+# for one (day, displayed fields of its plants), so an edit in one position re-renders one panel.
+_page_cache = {'key': None, 'html': None, 'etag': None}
+_panel_cache = {}
+_render_lock = threading.Lock()
+
+def panel_key(plants, today):
+    return (today, tuple((plant.id, plant.name, plant.day, plant.water_schedule, plant.food_schedule,
+                          plant.repotting_schedule) for plant in plants))
+
+def plant_care(plants, today):
+    # What each row shows besides the record, by plant id; records themselves are never modified
+    tomorrow = today + timedelta(days=1)
+    due_tomorrow = {(plant_id, kind) for _, plant_id, kind in event_index.due_between(tomorrow, tomorrow)}
+    care = {}
+    for plant in plants:
+        next_water = event_index.next_water(plant.id)
+        if next_water == today:
+            next_water = "Today!"
+        elif next_water == tomorrow:
+            next_water = "Tomorrow"
+        else:
+            next_water = next_water.isoformat() if next_water else None
+        care[plant.id] = PlantCare(next_water, (plant.id, 'food') in due_tomorrow,
+                                   (plant.id, 'repotting') in due_tomorrow)
+    return care
+
+def render_home(collection, today, version):
+    # Only plants whose schedule changed, or whose next event has passed, get recomputed
+    with span('schedule'):
+        event_index.sync(collection, today, version)
+    panels = {}
+    for position, panel_plants in collection.by_positions(range(4)).items():
+        key = panel_key(panel_plants, today)
+        cached = _panel_cache.get(position)
+        if cached is None or cached[0] != key:
+            with span('schedule'):
+                care = plant_care(panel_plants, today)
+            with span('render'):
+                html = render_template('panel.html', position=position, plants=panel_plants, care=care,
+                                       **PANELS[position])
+            cached = (key, html)
+            _panel_cache[position] = cached
+        panels[position] = Markup(cached[1])
+    with span('render'):
+        return render_template('index.html', panels=panels)
+
+# Exports are streamed: rows go out as they are produced, whatever the size of the collection
+EXPORT_TYPES = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv', 'ics': 'text/calendar'}
+MAX_CALENDAR_COUNT = 1000
+
+def export_response(lines, filename, kind):
+    response = Response(stream_with_context(lines), mimetype=EXPORT_TYPES[kind])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+@app.route('/export/plants.<kind>')
+def export_plants(kind):
+    if kind not in ('ndjson', 'csv'):
+        return jsonify({'error': "Plants export as ndjson or csv"}), 404
+    plants = get_storage().iter_all()
+    if kind == 'ndjson':
+        return export_response(ndjson_lines(plants), 'plants.ndjson', kind)
+    return export_response(csv_lines(plants, PLANT_FIELDS), 'plants.csv', kind)
+
+@app.route('/export/calendar.<kind>')
+def export_calendar(kind):
+    """The next ?count= (default 5) water, food and repotting dates of every plant."""
+    if kind not in EXPORT_TYPES:
+        return jsonify({'error': "Calendar exports as ndjson, csv or ics"}), 404
+    try:
+        count = int(request.args.get('count', 5))
+    except ValueError:
+        count = None
+    if count is None or not 1 <= count <= MAX_CALENDAR_COUNT:
+        return jsonify({'error': f"count must be a whole number between 1 and {MAX_CALENDAR_COUNT}"}), 400
+    events = care_calendar(get_storage().iter_all(), count, date.today())
+    if kind == 'ndjson':
+        return export_response(ndjson_lines(events), 'calendar.ndjson', kind)
+    if kind == 'csv':
+        return export_response(csv_lines(events, CALENDAR_FIELDS), 'calendar.csv', kind)
+    titles = {position: panel['title'] for position, panel in PANELS.items()}
+    return export_response(ical_lines(events, titles), 'sakura.ics', kind)
+
+# /api/plants answers from the indexes kept with the collection (id, position, name prefix) and the
+# event index (next due dates), so a query costs about the size of its result, not the collection
+MAX_QUERY_LIMIT = 1000
+
+def plant_json(plant):
+    next_events = event_index.next_events(plant.id)
+    return {**plant.to_dict(),
+            **{f'next_{kind}': (next_events[kind].isoformat() if next_events.get(kind) else None) for kind in EVENT_KINDS}}
+
+def is_due_before(plant_id, due_before):
+    return any(due is not None and due < due_before for due in event_index.next_events(plant_id).values())
+
+def query_plants(collection, position=None, name_prefix=None, due_before=None):
+    """Records matching every filter given, in id order. The event index has to be synced with collection."""
+    # Candidates come from one index, the other filters are checked on those alone
+    if name_prefix:
+        candidates = [collection.get(plant_id) for plant_id in collection.names.with_prefix(name_prefix)]
+    elif due_before is not None:
+        due_ids = {plant_id for due, plant_id, _ in event_index.due_between(date.min, due_before) if due < due_before}
+        candidates = [collection.get(plant_id) for plant_id in due_ids]
+    elif position is not None:
+        candidates = collection.at(position)
+    else:
+        candidates = collection
+    matches = []
+    for plant in candidates:
+        if plant is None:
+            continue
+        if position is not None and plant.position != position:
+            continue
+        if name_prefix and not plant.name.lower().startswith(name_prefix.lower()):
+            continue
+        if due_before is not None and not is_due_before(plant.id, due_before):
+            continue
+        matches.append(plant)
+    return sorted(matches, key=lambda plant: plant.id)
+
+def indexed_collection():
+    storage = get_storage()
+    with span('storage_read'):
+        collection = storage.collection()
+        version = storage.version()
+    with span('schedule'):
+        event_index.sync(collection, date.today(), version)
+    return collection
+
+@app.route('/api/plants')
+def api_plants():
+    """
+    Plants matching all of ?position=<n>, ?name_prefix=<start of the name, any case> and
+    ?due_before=<YYYY-MM-DD> (a watering, feeding or repotting before that day), in id order and
+    with their next_water/next_food/next_repotting dates. ?limit= (default 100) and ?offset= page
+    through them; pollers get a 304 on the ETag while the answer stays the same.
+    """
+    args = request.args
+    try:
+        position = int(args['position']) if args.get('position') else None
+        due_before = date.fromisoformat(args['due_before']) if args.get('due_before') else None
+        limit = int(args.get('limit', 100))
+        offset = int(args.get('offset', 0))
+    except ValueError as e:
+        return jsonify({'error': f"Invalid query: {e}"}), 400
+    if not 1 <= limit <= MAX_QUERY_LIMIT or offset < 0:
+        return jsonify({'error': f"limit must be between 1 and {MAX_QUERY_LIMIT} and offset not negative"}), 400
+
+    matches = query_plants(indexed_collection(), position, args.get('name_prefix'), due_before)
+    response = jsonify({'count': len(matches), 'plants': [plant_json(plant) for plant in matches[offset:offset + limit]]})
+    response.set_etag(hashlib.sha1(response.get_data()).hexdigest())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route('/api/plants/<int:plant_id>')
+def api_plant(plant_id):
+    plant = indexed_collection().get(plant_id)
+    if plant is None:
+        return jsonify({'error': f"No plant with id {plant_id}"}), 404
+    return jsonify(plant_json(plant))
+
 @app.route('/')
 def home():
-    # Retrieve updated table data from the database
-    # Pass this data to the template
-    plants_data = read_plants_data()
-    for plant in plants_data:
-        next_water = calculate_next_water_date(plant['date_added'], int(plant['water_schedule']))
-        if next_water == TODAY.strftime("%Y-%m-%d"):
-            plant['next_water'] = "Today!"
-        elif next_water == TOMORROW.strftime("%Y-%m-%d"):
-            plant['next_water'] = "Tomorrow"
-        else:
-           plant['next_water'] = next_water
-        plant['food_event'] = is_event_today_or_tomorrow(plant['date_added'], int(plant['food_schedule']), 'months')
-        plant['repotting_event'] = is_event_today_or_tomorrow(plant['date_added'], int(plant['repotting_schedule']), 'months')
-    # Organize data by position for display
-    organized_data = {position: [] for position in range(4)}
-    for plant in plants_data:
-        organized_data[plant['position']].append(plant)
-    return render_template('index.html', organized_data=organized_data)
+    # Retrieve updated table data from the database, as records indexed by position for display
+    storage = get_storage()
+    with span('storage_read'):
+        collection = storage.collection()
+        version = storage.version()
+    today = date.today()
+    page_key = (version, today)
+    with _render_lock:
+        if version is None or _page_cache['key'] != page_key:
+            html = render_home(collection, today, version)
+            _page_cache.update(key=page_key, html=html, etag=hashlib.sha1(html.encode('utf-8')).hexdigest())
+        html, etag = _page_cache['html'], _page_cache['etag']
+    # Displays polling / get a 304 with no body until the data or the day changes
+    response = make_response(html)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 if __name__ == '__main__':
     app.run(debug=True)
@@ -1,45 +1,109 @@
 
+import os
+import copy
 import json
-import pandas as pd
-import requests
-import boto3
+import time
+import random
+import threading
+import contextvars
+try:
+    import fcntl  # cross-process locking of the change log, not available on Windows
+except ImportError:
+    fcntl = None
 from datetime import datetime, timedelta
 
-tokens = {}
-with open("creds", "r") as creds:
-    for line in creds:
-        key, value = line.strip().split("=")
-        tokens[key] = value.replace('"', '')
+from api_cache import QueryCache, normalize_query, query_filename
+from metrics import span, timed
+from snapshot import encode_snapshot, decode_snapshot, is_snapshot
+from records import PlantCollection
 
+# Importing this module stays cheap: the creds file, requests/the provider client and boto3 are all
+# loaded the first time something needs them (see check_startup.py for the import-time budget).
 
-def trefle_find_plant(query: str):
-    call = f"https://trefle.io/api/v1/plants/search?q={query}&token={TREFLE_TOKEN}"
-    print(f"Running trefle API search:\n{call}")
-    response = requests.get(call)
+class _Tokens(dict):
+    """API tokens from the creds file, read on first use rather than at import."""
+    loaded = False
+    lock = threading.Lock()  # the first lookups often come from several threads at once
+    def __missing__(self, key):
+        with self.lock:
+            if not self.loaded:
+                with open("creds", "r") as creds:
+                    for line in creds:
+                        name, value = line.strip().split("=")
+                        self[name] = value.replace('"', '')
+                self.loaded = True  # only once every token is in
+        if key in self:
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
 
-    if response.status_code == 200:
-        data = response.json()
+tokens = _Tokens()
 
-        filename = "trefle_jsons/" + query.replace(" ", "_") + "_plant.json"
-        with open(filename, 'w') as file:
-            json.dump(data, file, indent=4)
-    else:
-        print(f"Failed to retrieve plants data, Status Code: {response.status_code}")
-def trefle_find_species(query: str):
-    call = f"https://trefle.io/api/v1/species/search?q={query}&token={TREFLE_TOKEN}"
-    print(f"Running trefle API search:\n{call}")
-    response = requests.get(call)
+
+# Every response is kept on disk and served from there until it expires, see api_cache.py
+trefle_cache = QueryCache("trefle_jsons")
+perenual_cache = QueryCache("perenual_jsons")
+
+# Set by callers working within an API call budget (bulk imports); every request that misses the
+# cache waits for it, however many calls one lookup turns into
+api_limiter = contextvars.ContextVar('api_limiter', default=None)
+
+class RetryableAPIError(Exception):
+    """Rate limited (429), a server error or a timeout, the same call may well work a bit later."""
+    def __init__(self, status_code):
+        super().__init__(f"API call failed ({status_code})")
+        self.status_code = status_code
+
+def _cached_api_get(api, cache, key, filename, path, params, failure, retryable_errors=False):
+    data = cache.get(key)
+    if data is not None:
+        return data
+    import requests
+    from provider_client import get_provider_client
+
+    client = get_provider_client()
+    limiter = api_limiter.get()
+    if limiter is not None:
+        limiter.wait()
+    print(f"Running {api} API search for '{key}':\n{client.url(api, path)}")
+    try:
+        response = client.get(api, path, params)
+    except requests.RequestException as e:
+        print(f"{failure}: {e}")
+        if retryable_errors:
+            raise RetryableAPIError(type(e).__name__)
+        return None
 
     if response.status_code == 200:
         data = response.json()
-
-        filename = "trefle_jsons/" + query.replace(" ", "_") + "_species.json"
-        with open(filename, 'w') as file:
-            json.dump(data, file, indent=4)
+        cache.put(key, data, filename)
+        return data
     else:
-        print(f"Failed to retrieve species data, Status Code: {response.status_code}")
+        print(f"{failure}, Status Code: {response.status_code}")
+        if retryable_errors and (response.status_code == 429 or response.status_code >= 500):
+            raise RetryableAPIError(response.status_code)
+        return None
+
+def trefle_find_plant(query: str):
+    query = normalize_query(query)
+    return _cached_api_get("trefle", trefle_cache, f"plants/search/{query}", query_filename(query) + "_plant.json",
+                           "/plants/search", {'q': query, 'token': tokens['TREFLE_TOKEN']},
+                           "Failed to retrieve plants data")
+@timed('trefle_query')
+def trefle_find_species(query: str, retryable_errors=False):
+    query = normalize_query(query)
+    return _cached_api_get("trefle", trefle_cache, f"species/search/{query}", query_filename(query) + "_species.json",
+                           "/species/search", {'q': query, 'token': tokens['TREFLE_TOKEN']},
+                           "Failed to retrieve species data", retryable_errors)
 def trefle_pull_request(query: str):
-    response = requests.get(query)
+    # query is a full url, e.g. a pagination link out of an earlier response
+    import requests
+    from provider_client import get_provider_client
+
+    try:
+        response = get_provider_client().get_url("trefle", query)
+    except requests.RequestException as e:
+        print(f"Failed to retrieve request: {e}")
+        return None
 
     if response.status_code == 200:
         data = response.json()
@@ -47,120 +111,508 @@ def trefle_pull_request(query: str):
         filename = "trefle_jsons/" + "request.json"
         with open(filename, 'w') as file:
             json.dump(data, file, indent=4)
+        return data
     else:
         print(f"Failed to retrieve request, Status Code: {response.status_code}")
 def trefle_pull_plant(slug: str):
-    call = f"https://trefle.io/api/v1/plants/{slug}?token={TREFLE_TOKEN}"
-    print(f"Running trefle API search:\n{call}")
-    response = requests.get(call)
-
-    if response.status_code == 200:
-        data = response.json()
-        
-        filename = f"trefle_jsons/{slug}_plant.json"
-        with open(filename, 'w') as file:
-            json.dump(data, file, indent=4)
-    else:
-        print(f"Failed to retrieve plants data, Status Code: {response.status_code}")
+    return _cached_api_get("trefle", trefle_cache, f"plants/{slug}", f"{slug}_plant.json",
+                           f"/plants/{slug}", {'token': tokens['TREFLE_TOKEN']}, "Failed to retrieve plants data")
 def trefle_pull_species(slug: str):
-    call = f"https://trefle.io/api/v1/species/{slug}?token={TREFLE_TOKEN}"
-    print(f"Running trefle API search:\n{call}")
-    response = requests.get(call)
-
-    if response.status_code == 200:
-        data = response.json()
-
-        filename = f"trefle_jsons/{slug}_species.json"
-        with open(filename, 'w') as file:
-            json.dump(data, file, indent=4)
-    else:
-        print(f"Failed to retrieve species data, Status Code: {response.status_code}")
+    return _cached_api_get("trefle", trefle_cache, f"species/{slug}", f"{slug}_species.json",
+                           f"/species/{slug}", {'token': tokens['TREFLE_TOKEN']}, "Failed to retrieve species data")
 def trefle_pull_plant_id(id: int):
     id_str = str(id)
     print(f"Finding plant id: {id_str}")
-    call = f"https://trefle.io/api/v1/plants/{id_str}?token={TREFLE_TOKEN}"
-    print(f"Running trefle API search:\n{call}")
-    response = requests.get(call)
-
-    if response.status_code == 200:
-        data = response.json()
-        
-        filename = f"trefle_jsons/{id_str}_plant.json"
-        with open(filename, 'w') as file:
-            json.dump(data, file, indent=4)
-    else:
-        print(f"Failed to retrieve plants data, Status Code: {response.status_code}")
-def trefle_pull_species_id(id: int):
+    return _cached_api_get("trefle", trefle_cache, f"plants/{id_str}", f"{id_str}_plant.json",
+                           f"/plants/{id_str}", {'token': tokens['TREFLE_TOKEN']}, "Failed to retrieve plants data")
+def trefle_pull_species_id(id: int, retryable_errors=False):
     id_str = str(id)
     print(f"Finding species id: {id_str}")
-    call = f"https://trefle.io/api/v1/species/{id_str}?token={TREFLE_TOKEN}"
-    print(f"Running trefle API search:\n{call}")
-    response = requests.get(call)
+    return _cached_api_get("trefle", trefle_cache, f"species/{id_str}", f"{id_str}_species.json",
+                           f"/species/{id_str}", {'token': tokens['TREFLE_TOKEN']}, "Failed to retrieve species data",
+                           retryable_errors)
 
-    if response.status_code == 200:
-        data = response.json()
 
-        filename = f"trefle_jsons/{id_str}_species.json"
-        with open(filename, 'w') as file:
-            json.dump(data, file, indent=4)
-    else:
-        print(f"Failed to retrieve species data, Status Code: {response.status_code}")
+def perenual_pull_species_list(page=1):
+    filename = "plant_list.json"
+    if page != 1:
+        filename = f"plant_list_page_{page}.json"
+    return _cached_api_get("perenual", perenual_cache, f"species-list/page/{page}", filename,
+                           "/species-list", {'key': tokens['PERENUAL_TOKEN'], 'page': page},
+                           "Failed to retrieve plants data")
+@timed('perenual_query')
+def perenual_query_api(query: str, retryable_errors=False):
+    # retryable_errors raises RetryableAPIError for 429/5xx instead of treating them as no results
+    query = normalize_query(query)
+    data = _cached_api_get("perenual", perenual_cache, query, f"query_{query_filename(query)}.json",
+                           "/species-list", {'key': tokens['PERENUAL_TOKEN'], 'q': query},
+                           "Failed to retrieve plants data", retryable_errors)
+    return data['data'] if data is not None else []
 
+    
+bucket_name = 'plants-data'
+file_name = 'plant_data.json'
+_s3 = None
+_s3_lock = threading.Lock()
 
-def perenual_pull_species_list(page=1):
-    call = f"https://perenual.com/api/species-list?key={tokens['PERENUAL_TOKEN']}&page={page}"
-    print(f"Running perenual API search:\n{call}")
-    response = requests.get(call)
+def get_s3():
+    global _s3
+    with _s3_lock:
+        if _s3 is None:
+            import boto3
+            _s3 = boto3.client('s3')
+        return _s3
+def _s3_error_code(error):
+    # botocore's ClientError carries the S3 error code; anything else (no response) has none
+    response = getattr(error, 'response', None)
+    return response.get('Error', {}).get('Code') if isinstance(response, dict) else None
 
-    if response.status_code == 200:
-        data = response.json()
+# Parsed copy of plant_data.json kept in memory between requests. Every read revalidates it with a
+# conditional GET on the stored ETag (a 304 carries no body), unless it was checked less than
+# SAKURA_CACHE_TTL seconds ago, in which case S3 is not contacted at all.
+CACHE_TTL = float(os.environ.get('SAKURA_CACHE_TTL', '0'))
+_plants_cache = {'data': None, 'etag': None, 'next_id': None, 'checked': 0.0}
+_cache_lock = threading.Lock()
 
-        filename = "perenual_jsons/plant_list.json"
-        if page != 1:
-            filename = f"perenual_jsons/plant_list_page_{page}.json"
-        with open(filename, 'w') as file:
-            json.dump(data, file, indent=4)
-    else:
-        print(f"Failed to retrieve plants data, Status Code: {response.status_code}")
-def perenual_query_api(query: str):
-    query = query.lower()
-    call = f"https://perenual.com/api/species-list?key={tokens['PERENUAL_TOKEN']}&q={query.lower()}"
-    print(f"Running perenual API search:\n{call}")
-    response = requests.get(call)
+# Conditional writes: a put only lands if the object still has the ETag we read, otherwise the
+# document is re-read and the change applied again on top of it.
+MAX_WRITE_RETRIES = int(os.environ.get('SAKURA_WRITE_RETRIES', '8'))
+NEXT_ID_METADATA = 'next-id'  # stored next to the document so ids never need a max() scan
+CONFLICT_CODES = ('PreconditionFailed', 'ConditionalRequestConflict', '412', '409')
 
-    if response.status_code == 200:
-        data = response.json()
+class WriteConflict(Exception):
+    pass
 
-        filename = f"perenual_jsons/query_{query.lower().replace(' ', '_')}.json"
-        with open(filename, 'w') as file:
-            json.dump(data, file, indent=4)
-        return data['data']
-    else:
-        print(f"Failed to retrieve plants data, Status Code: {response.status_code}")
-        return []
+# plant_data.json is written as a JSON list, or as the compressed columnar snapshot (snapshot.py)
+# with SAKURA_SNAPSHOT_FORMAT=columnar. Reads accept both whatever the setting.
+SNAPSHOT_FORMAT = os.environ.get('SAKURA_SNAPSHOT_FORMAT', 'json')
 
-    
-s3 = boto3.client('s3')
-bucket_name = 'plants-data'
-file_name = 'plant_data.json'
+def _encode_plant_data(plants):
+    if SNAPSHOT_FORMAT == 'columnar':
+        try:
+            return encode_snapshot(plants)
+        except (ValueError, KeyError, TypeError) as e:
+            print(f"Writing plant data as JSON, it doesn't fit the columnar snapshot: {e}")
+    return json.dumps(plants).encode('utf-8')
+def _decode_plant_data(body):
+    """(collection, plant dicts or None): a columnar snapshot becomes records without any dicts."""
+    if is_snapshot(body):
+        return decode_snapshot(body).to_collection(), None
+    plants = json.loads(body.decode('utf-8'))
+    return PlantCollection.from_dicts(plants), plants
+
+def _store_in_cache(plants, etag, next_id):
+    # Kept as compact records (records.py), callers get fresh dicts or the shared read-only collection
+    collection = plants if isinstance(plants, PlantCollection) else PlantCollection.from_dicts(plants)
+    with _cache_lock:
+        _plants_cache['data'] = collection
+        _plants_cache['etag'] = etag
+        _plants_cache['next_id'] = next_id
+        _plants_cache['checked'] = time.monotonic()
+    return collection
+def invalidate_s3_cache():
+    with _cache_lock:
+        _plants_cache['data'] = None
+        _plants_cache['etag'] = None
+        _plants_cache['next_id'] = None
+        _plants_cache['checked'] = 0.0
+def _scan_next_id(plants):
+    # Only needed for documents written before the next-id metadata existed
+    return max([plant.get('id', 0) for plant in plants] + [0]) + 1
+
+def _fetch_s3_document(records=False):
+    """
+    Returns (plants, etag, next_id), from memory when S3 says our copy is current. plants is a list
+    of dicts the caller may change, or with records=True the cached PlantCollection, not to be changed.
+    """
+    with _cache_lock:
+        cached, etag, next_id, checked = (
+            _plants_cache['data'], _plants_cache['etag'], _plants_cache['next_id'], _plants_cache['checked'])
+    if cached is not None and time.monotonic() - checked < CACHE_TTL:
+        return (cached if records else cached.to_dicts()), etag, next_id
+    request = {'Bucket': bucket_name, 'Key': file_name}
+    if cached is not None and etag:
+        request['IfNoneMatch'] = etag
+    try:
+        with span('s3_get'):
+            data = get_s3().get_object(**request)
+            body = data['Body'].read()
+    except Exception as e:
+        if _s3_error_code(e) not in ('304', 'NotModified'):
+            raise
+        with _cache_lock:
+            _plants_cache['checked'] = time.monotonic()
+        return (cached if records else cached.to_dicts()), etag, next_id
+    with span('json_parse'):
+        collection, plants_data = _decode_plant_data(body)
+    #plants_data = plants_data['plants']
+    next_id = data.get('Metadata', {}).get(NEXT_ID_METADATA)
+    next_id = int(next_id) if next_id else _scan_next_id(collection)
+    _store_in_cache(collection, data.get('ETag'), next_id)
+    if records:
+        return collection, data.get('ETag'), next_id
+    return (plants_data if plants_data is not None else collection.to_dicts()), data.get('ETag'), next_id
+
+def s3_data_version():
+    """ETag of the document as of the last read or write in this process."""
+    with _cache_lock:
+        return _plants_cache['etag']
+
+@timed('s3_read')
+def read_s3_collection():
+    """The plants as a records.PlantCollection shared with the cache, None if S3 can't be read."""
+    try:
+        return _fetch_s3_document(records=True)[0]
+    except Exception as e:
+        print(e)
+        return None
+
+@timed('s3_read')
 def read_from_s3():
     try:
-        data = s3.get_object(Bucket=bucket_name, Key=file_name)
-        plants_data = json.loads(data['Body'].read().decode('utf-8'))
-        return plants_data
-        #return plants_data['plants']
+        return _fetch_s3_document()[0]
     except Exception as e:
         print(e)
         return None  # or handle error appropriately
+@timed('s3_write')
 def write_to_s3(data):
     try:
-        s3.put_object(Bucket=bucket_name, Key=file_name, Body=json.dumps(data))
+        with _cache_lock:
+            next_id = max(_plants_cache['next_id'] or 0, _scan_next_id(data))
+        with span('json_dump'):
+            body = _encode_plant_data(data)
+        with span('s3_put'):
+            response = get_s3().put_object(Bucket=bucket_name, Key=file_name, Body=body,
+                                           Metadata={NEXT_ID_METADATA: str(next_id)})
+        # The next read can be served from memory, S3 will answer 304 for this ETag
+        _store_in_cache(data, response.get('ETag'), next_id)
         print("Success!")
     except Exception as e:
+        invalidate_s3_cache()
         print(e)
 
+@timed('s3_update')
+def update_s3(mutate, retries=MAX_WRITE_RETRIES):
+    """
+    Compare-and-swap update of plant_data.json. mutate(plants, allocate_id) edits the list in place
+    and its return value is passed back; allocate_id() hands out the next plant id. If another
+    writer got in first the put is rejected, and mutate runs again on the re-read document.
+    """
+    for attempt in range(retries):
+        try:
+            plants, etag, next_id = _fetch_s3_document()
+            conditions = {'IfMatch': etag}
+        except Exception as e:
+            if _s3_error_code(e) != 'NoSuchKey':
+                raise
+            plants, next_id = [], 1
+            conditions = {'IfNoneMatch': '*'}  # first write, nobody else may create it either
+
+        ids = {'next': next_id}
+        def allocate_id():
+            ids['next'] += 1
+            return ids['next'] - 1
+        result = mutate(plants, allocate_id)
+
+        with span('json_dump'):
+            body = _encode_plant_data(plants)
+        try:
+            with span('s3_put'):
+                response = get_s3().put_object(Bucket=bucket_name, Key=file_name, Body=body,
+                                               Metadata={NEXT_ID_METADATA: str(ids['next'])}, **conditions)
+        except Exception as e:
+            if _s3_error_code(e) not in CONFLICT_CODES:
+                raise
+            print(f"Plant data changed underneath us, retrying write (attempt {attempt + 1})")
+            invalidate_s3_cache()
+            time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+            continue
+        _store_in_cache(plants, response.get('ETag'), ids['next'])
+        return result
+    raise WriteConflict(f"Gave up writing {file_name} after {retries} conflicting attempts")
+
+def add_plant_to_s3(plant):
+    """Appends a plant under a freshly allocated id and returns that id."""
+    def append(plants, allocate_id):
+        plant['id'] = allocate_id()
+        plants.append(dict(plant))
+        return plant['id']
+    return update_s3(append)
+def add_plants_to_s3(plants):
+    """Appends several plants in one conditional write, returns their ids."""
+    def append(stored_plants, allocate_id):
+        for plant in plants:
+            plant['id'] = allocate_id()
+            stored_plants.append(dict(plant))
+        return [plant['id'] for plant in plants]
+    return update_s3(append)
+def update_plant_in_s3(plant_id, updates):
+    """Applies updates to the latest stored version of one plant, returns False if it is gone."""
+    def apply(plants, allocate_id):
+        for plant in plants:
+            if plant['id'] == plant_id:
+                plant.update(updates)
+                return True
+        return False
+    return update_s3(apply)
+def update_plants_in_s3(changes):
+    """Applies {plant id: updates} in one conditional write, returns the ids that were found."""
+    def apply(plants, allocate_id):
+        updated = []
+        for plant in plants:
+            if plant['id'] in changes:
+                plant.update(changes[plant['id']])
+                updated.append(plant['id'])
+        return updated
+    return update_s3(apply)
+
+
+# Any other JSON object in the bucket (the shards and manifests of storage.ShardedS3Storage), with
+# the same conditional GET caching and compare-and-swap writes as plant_data.json above
+_objects_cache = {}  # key -> (data, etag, checked)
+
+def read_s3_json(key, default=None):
+    """Returns (data, etag) of a JSON object, or (a copy of default, None) if it doesn't exist."""
+    with _cache_lock:
+        cached = _objects_cache.get(key)
+    if cached is not None and time.monotonic() - cached[2] < CACHE_TTL:
+        return copy.deepcopy(cached[0]), cached[1]
+    request = {'Bucket': bucket_name, 'Key': key}
+    if cached is not None:
+        request['IfNoneMatch'] = cached[1]
+    try:
+        with span('s3_get'):
+            response = get_s3().get_object(**request)
+            body = response['Body'].read()
+    except Exception as e:
+        code = _s3_error_code(e)
+        if code in ('304', 'NotModified'):
+            with _cache_lock:
+                _objects_cache[key] = (cached[0], cached[1], time.monotonic())
+            return copy.deepcopy(cached[0]), cached[1]
+        if code in ('NoSuchKey', '404'):
+            with _cache_lock:
+                _objects_cache.pop(key, None)
+            return copy.deepcopy(default), None
+        raise
+    with span('json_parse'):
+        data = json.loads(body.decode('utf-8'))
+    with _cache_lock:
+        _objects_cache[key] = (data, response.get('ETag'), time.monotonic())
+    return copy.deepcopy(data), response.get('ETag')
+
+def put_s3_json(key, data, etag=None, conditional=True):
+    """
+    Writes data to key and returns the new ETag. When conditional, the put only lands if the object
+    still has etag (with etag None: if it doesn't exist yet), otherwise None is returned.
+    """
+    conditions = {}
+    if conditional:
+        conditions = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+    with span('json_dump'):
+        body = json.dumps(data)
+    try:
+        with span('s3_put'):
+            response = get_s3().put_object(Bucket=bucket_name, Key=key, Body=body, **conditions)
+    except Exception as e:
+        with _cache_lock:
+            _objects_cache.pop(key, None)
+        if _s3_error_code(e) in CONFLICT_CODES:
+            return None
+        raise
+    with _cache_lock:
+        _objects_cache[key] = (copy.deepcopy(data), response.get('ETag'), time.monotonic())
+    return response.get('ETag')
+
+def update_s3_json(key, mutate, default=None, retries=MAX_WRITE_RETRIES):
+    """Compare-and-swap edit of one JSON object: mutate(data) edits it in place, its return value is passed back."""
+    for attempt in range(retries):
+        data, etag = read_s3_json(key, default)
+        result = mutate(data)
+        if put_s3_json(key, data, etag) is not None:
+            return result
+        print(f"{key} changed underneath us, retrying write (attempt {attempt + 1})")
+        time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+    raise WriteConflict(f"Gave up writing {key} after {retries} conflicting attempts")
+
+def s3_objects_version(prefix):
+    """ETags of the objects under prefix as of the last read or write in this process, as one token."""
+    with _cache_lock:
+        etags = sorted((key, cached[1]) for key, cached in _objects_cache.items() if key.startswith(prefix))
+    return '|'.join(f"{key}={etag}" for key, etag in etags) or None
 
 def read_local_plant_data(filename='plants.json'):
     with open(filename, 'r') as file:
         data = json.load(file)
     return data['plants']
+
+
+# Append-only change log: adds and edits are written as one small JSON line each, so the cost of a
+# write depends on the change and not on the size of the collection. Every SAKURA_COMPACT_EVERY
+# records the current state is written out as a snapshot and the log segment is moved to history/,
+# which keeps an edit history of every plant. Layout of the directory:
+#   snapshot.json   {"seq": <last change folded in>, "plants": [...]}
+#   log.jsonl       changes after the snapshot, one {"seq", "ts", "op", ...} record per line
+#   history/        compacted log segments, <first seq>-<last seq>.jsonl
+CHANGELOG_DIR = os.environ.get('SAKURA_CHANGELOG_DIR', 'plants_log')
+COMPACT_EVERY = int(os.environ.get('SAKURA_COMPACT_EVERY', '500'))
+_changelog_state = {}
+_changelog_lock = threading.Lock()
+
+def _changelog_paths(directory):
+    return (os.path.join(directory, 'snapshot.json'),
+            os.path.join(directory, 'log.jsonl'),
+            os.path.join(directory, 'history'))
+
+def _apply_change(state, record):
+    if record['seq'] <= state['seq']:
+        return  # already folded into the snapshot we loaded
+    if record['op'] == 'add':
+        state['plants'][record['plant']['id']] = dict(record['plant'])
+        state['next_id'] = max(state['next_id'], record['plant']['id'] + 1)
+    elif record['op'] == 'update' and record['id'] in state['plants']:
+        state['plants'][record['id']].update(record['changes'])
+    elif record['op'] == 'reset':  # whole collection replaced, e.g. by an import
+        state['plants'] = {plant['id']: dict(plant) for plant in record['plants']}
+        state['next_id'] = max(list(state['plants']) + [state['next_id'] - 1]) + 1
+    state['seq'] = record['seq']
+
+def _changelog_catch_up(directory):
+    """Applies whatever was appended to the log since the last call, reloading after a compaction."""
+    snapshot_path, log_path, _ = _changelog_paths(directory)
+    state = _changelog_state.get(directory)
+    try:
+        log = open(log_path, 'rb')
+    except FileNotFoundError:
+        log = None
+    try:
+        log_stat = os.fstat(log.fileno()) if log else None
+        log_id = (log_stat.st_dev, log_stat.st_ino) if log_stat else None
+        if state is None or state['log_id'] != log_id or (log_stat and log_stat.st_size < state['offset']):
+            state = {'plants': {}, 'seq': 0, 'snapshot_seq': 0, 'next_id': 1, 'offset': 0, 'log_id': log_id}
+            if os.path.exists(snapshot_path):
+                with open(snapshot_path, 'r') as file:
+                    snapshot = json.load(file)
+                state['plants'] = {plant['id']: plant for plant in snapshot['plants']}
+                state['seq'] = state['snapshot_seq'] = snapshot['seq']
+                state['next_id'] = max(list(state['plants']) + [0]) + 1
+            _changelog_state[directory] = state
+        if log:
+            log.seek(state['offset'])
+            for line in log:
+                if not line.endswith(b'\n'):
+                    break  # record still being written, pick it up next time
+                _apply_change(state, json.loads(line))
+                state['offset'] += len(line)
+    finally:
+        if log:
+            log.close()
+    return state
+
+class _ChangelogWriteLock:
+    # Serializes appends between threads, and between processes where fcntl is available
+    def __init__(self, directory):
+        self.path = os.path.join(directory, '.lock')
+    def __enter__(self):
+        _changelog_lock.acquire()
+        self.file = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        self.file.close()
+        _changelog_lock.release()
+
+def _append_changes(directory, build_records):
+    """Appends the records build_records(state) returns in a single write, returns them with their seq."""
+    os.makedirs(directory, exist_ok=True)
+    with _ChangelogWriteLock(directory):
+        state = _changelog_catch_up(directory)
+        records = build_records(state)
+        if not records:
+            return []
+        ts = datetime.now().isoformat(timespec='seconds')
+        records = [{'seq': state['seq'] + number, 'ts': ts, **record} for number, record in enumerate(records, 1)]
+        with open(_changelog_paths(directory)[1], 'ab') as log:
+            log.write(''.join(json.dumps(record) + '\n' for record in records).encode('utf-8'))
+        state = _changelog_catch_up(directory)
+        if state['seq'] - state['snapshot_seq'] >= COMPACT_EVERY:
+            _compact_changelog_locked(directory, state)
+        return records
+def _append_change(directory, build_record):
+    def build_records(state):
+        record = build_record(state)
+        return [record] if record is not None else []
+    records = _append_changes(directory, build_records)
+    return records[0] if records else None
+
+def _compact_changelog_locked(directory, state):
+    snapshot_path, log_path, history_path = _changelog_paths(directory)
+    tmp_path = snapshot_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump({'seq': state['seq'], 'plants': list(state['plants'].values())}, file)
+    os.replace(tmp_path, snapshot_path)
+    # Readers that still hold the old log skip its records by seq once they load the new snapshot
+    if os.path.exists(log_path):
+        os.makedirs(history_path, exist_ok=True)
+        segment = f"{state['snapshot_seq'] + 1:08d}-{state['seq']:08d}.jsonl"
+        os.replace(log_path, os.path.join(history_path, segment))
+    _changelog_state.pop(directory, None)
+
+def read_changelog_plant_data(directory=CHANGELOG_DIR):
+    with _changelog_lock:
+        state = _changelog_catch_up(directory)
+        return [dict(plant) for plant in state['plants'].values()]
+def changelog_version(directory=CHANGELOG_DIR):
+    """Sequence number of the last change this process has read or written."""
+    state = _changelog_state.get(directory)
+    return state['seq'] if state else None
+def changelog_add_plant(plant, directory=CHANGELOG_DIR):
+    """Logs a new plant under the next free id and returns that id."""
+    def build(state):
+        plant['id'] = state['next_id']
+        return {'op': 'add', 'plant': plant}
+    return _append_change(directory, build)['plant']['id']
+def changelog_add_plants(plants, directory=CHANGELOG_DIR):
+    """Logs several new plants in one append, returns their ids."""
+    def build(state):
+        for next_id, plant in enumerate(plants, state['next_id']):
+            plant['id'] = next_id
+        return [{'op': 'add', 'plant': plant} for plant in plants]
+    return [record['plant']['id'] for record in _append_changes(directory, build)]
+def changelog_update_plant(plant_id, updates, directory=CHANGELOG_DIR):
+    """Logs only the changed fields, returns False if the plant does not exist."""
+    def build(state):
+        if plant_id not in state['plants']:
+            return None
+        return {'op': 'update', 'id': plant_id, 'changes': updates}
+    return _append_change(directory, build) is not None
+def changelog_update_plants(changes, directory=CHANGELOG_DIR):
+    """Logs {plant id: updates} in one append, returns the ids that exist."""
+    def build(state):
+        return [{'op': 'update', 'id': plant_id, 'changes': updates}
+                for plant_id, updates in changes.items() if plant_id in state['plants']]
+    return [record['id'] for record in _append_changes(directory, build)]
+def changelog_replace_plants(plants, directory=CHANGELOG_DIR):
+    _append_change(directory, lambda state: {'op': 'reset', 'plants': plants})
+def compact_changelog(directory=CHANGELOG_DIR):
+    os.makedirs(directory, exist_ok=True)
+    with _ChangelogWriteLock(directory):
+        _compact_changelog_locked(directory, _changelog_catch_up(directory))
+
+def read_plant_history(plant_id, directory=CHANGELOG_DIR):
+    """Every logged change of one plant, oldest first, including compacted segments."""
+    _, log_path, history_path = _changelog_paths(directory)
+    segments = sorted(os.listdir(history_path)) if os.path.isdir(history_path) else []
+    paths = [os.path.join(history_path, segment) for segment in segments] + [log_path]
+    history = []
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as file:
+            for line in file:
+                record = json.loads(line)
+                if record.get('id') == plant_id or record.get('plant', {}).get('id') == plant_id:
+                    history.append(record)
+    return history
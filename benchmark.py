@@ -0,0 +1,235 @@
+"""
+Benchmarks for the hot paths: home(), /add-plant, update_plant_data and the dashboard callbacks.
+
+Runs against synthetic collections, with a local S3 stand-in (moto, `pip install "moto[s3]"`) for the
+s3 engine and a stub Perenual server on localhost, so nothing leaves the machine. Prints latency
+percentiles, throughput and peak allocated memory per scenario:
+
+    python benchmark.py --sizes 1000 10000 --storage s3 sqlite
+    python benchmark.py --json results.json
+    python benchmark.py --baseline results.json --max-regression 25   # exits 1 on a p50 regression
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+import threading
+import tracemalloc
+from datetime import date, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WATERINGS = ['Frequent', 'Average', 'Minimum', 'None']
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def synthetic_plants(count, seed=0):
+    """count plants spread over the four positions, added over the last ~5 years, varied schedules."""
+    rng = random.Random(seed)
+    today = date.today()
+    return [{
+        "id": plant_id,
+        "position": plant_id % 4,
+        "name": f"Plant {plant_id} {rng.choice(['Fern', 'Ficus', 'Orchid', 'Pothos', 'Rose', 'Basil'])}",
+        "date_added": (today - timedelta(days=rng.randint(0, 5 * 365))).isoformat(),
+        "water_schedule": rng.choice([1, 3, 5, 7, 10, 9999]),
+        "food_schedule": rng.choice([0, 1, 2, 3]),
+        "repotting_schedule": rng.choice([0, 6, 12]),
+        "temperature_min": None,
+        "temperature_max": None
+    } for plant_id in range(count)]
+
+
+class StubPerenual(BaseHTTPRequestHandler):
+    """Answers /species-list?q=... with a single species, after an optional artificial delay."""
+    protocol_version = 'HTTP/1.1'
+    delay = 0.0
+
+    def do_GET(self):
+        time.sleep(self.delay)
+        body = json.dumps({'data': [{'id': 1, 'common_name': 'stub', 'watering': random.choice(WATERINGS)}],
+                           'last_page': 1}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_stub_server(delay):
+    StubPerenual.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubPerenual)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def measure(operation, iterations):
+    """Latencies in ms of iterations calls to operation(i)."""
+    latencies = []
+    with contextlib.redirect_stdout(io.StringIO()):  # the app prints every API call
+        for i in range(iterations):
+            start = time.perf_counter()
+            operation(i)
+            latencies.append((time.perf_counter() - start) * 1000)
+    return latencies
+
+def peak_memory(operation, iterations):
+    """Peak traced allocation in MB while running operation a few times."""
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            for i in range(iterations):
+                operation(i)
+        return tracemalloc.get_traced_memory()[1] / 1024 / 1024
+    finally:
+        tracemalloc.stop()
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    def percentile(q):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+    return {'n': len(ordered), 'p50': percentile(50), 'p90': percentile(90), 'p99': percentile(99),
+            'ops_per_s': 1000 * len(ordered) / sum(ordered) if sum(ordered) else float('inf')}
+
+
+def run_scenarios(app, storage, size, iterations):
+    """Seeds storage with size plants and times every scenario against it."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        storage.write_all(synthetic_plants(size))
+    client = app.app.test_client()
+    rng = random.Random(size)
+    write_iterations = max(3, iterations // 5)  # writes rewrite whole documents on some engines
+
+    def home_cold(i):
+        app._page_cache['key'] = None  # rendered page thrown away, panels and index kept
+        app._panel_cache.clear()
+        client.get('/')
+    def home_warm(i):
+        client.get('/')
+    etag = client.get('/').headers.get('ETag')
+    def home_not_modified(i):
+        client.get('/', headers={'If-None-Match': etag})
+    def add_plant(i):
+        client.post('/add-plant', data={'plant_name': f"bench plant {size} {i} {time.time()}", 'position': str(i % 4)})
+    def update_plant(i):
+        app.update_plant_data(rng.randrange(size), {'water_schedule': rng.choice([1, 3, 5, 7])})
+    def dash_select(i):
+        app.update_input_values(rng.randrange(size))
+    def dash_search(i):
+        app.update_dropdown_options(rng.choice(['fern', 'Plant 1', 'orchid', '']), None)
+
+    scenarios = [
+        ('home (cold render)', home_cold, iterations),
+        ('home (cached)', home_warm, iterations),
+        ('home (304)', home_not_modified, iterations),
+        ('add-plant', add_plant, write_iterations),
+        ('update_plant_data', update_plant, write_iterations),
+        ('dash update_input_values', dash_select, iterations),
+        ('dash dropdown search', dash_search, iterations),
+    ]
+    results = {}
+    for name, operation, count in scenarios:
+        with contextlib.redirect_stdout(io.StringIO()):
+            operation(-1)  # warm up caches and lazy imports
+        results[name] = summarize(measure(operation, count))
+        results[name]['peak_mb'] = peak_memory(operation, min(count, 3))
+    return results
+
+
+def compare(results, baseline, max_regression, min_delta_ms=1.0):
+    """
+    The scenarios whose p50 got more than max_regression percent slower. Differences under
+    min_delta_ms are timer noise on the sub-millisecond scenarios and never count.
+    """
+    regressions = []
+    for key, result in results.items():
+        if key in baseline and baseline[key]['p50'] > 0:
+            change = 100 * (result['p50'] - baseline[key]['p50']) / baseline[key]['p50']
+            if change > max_regression and result['p50'] - baseline[key]['p50'] >= min_delta_ms:
+                regressions.append(f"{key}: p50 {baseline[key]['p50']:.2f} -> {result['p50']:.2f} ms (+{change:.0f}%)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sakura hot path benchmarks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--storage', nargs='+', default=['s3'], choices=['s3', 's3-sharded', 'local', 'changelog', 'sqlite'])
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--api-delay', type=float, default=0.0, help="seconds the stub Perenual server waits")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--baseline', help="results file of an earlier run to compare p50s against")
+    parser.add_argument('--max-regression', type=float, default=25.0, help="allowed p50 slowdown in percent")
+    parser.add_argument('--min-delta-ms', type=float, default=1.0, help="p50 slowdowns smaller than this are ignored")
+    args = parser.parse_args()
+
+    # Everything the app writes (API caches, local engines) goes to a scratch directory
+    workdir = tempfile.mkdtemp(prefix='sakura-bench-')
+    os.chdir(workdir)
+    sys.path.insert(0, ROOT)
+    for name, value in [('AWS_ACCESS_KEY_ID', 'bench'), ('AWS_SECRET_ACCESS_KEY', 'bench'),
+                        ('AWS_DEFAULT_REGION', 'us-east-1')]:
+        os.environ[name] = value
+
+    mock = None
+    if any(engine.startswith('s3') for engine in args.storage):
+        try:
+            from moto import mock_aws
+        except ImportError:
+            sys.exit('The S3 benchmarks need moto as a local S3 stand-in: pip install "moto[s3]"')
+        mock = mock_aws()
+        mock.start()
+
+    import app
+    import backend
+    import storage
+    import provider_client
+
+    backend.tokens.update({'PERENUAL_TOKEN': 'bench', 'TREFLE_TOKEN': 'bench'})
+    backend.tokens.loaded = True
+    server = start_stub_server(args.api_delay)
+    stub_url = f"http://127.0.0.1:{server.server_port}"
+    provider_client.set_provider_client(provider_client.ProviderClient(base_urls={'perenual': stub_url, 'trefle': stub_url}))
+    if mock:
+        backend.get_s3().create_bucket(Bucket=backend.bucket_name)
+
+    results = {}
+    try:
+        for engine in args.storage:
+            storage._storage = storage.create_storage(engine)
+            for size in args.sizes:
+                backend.invalidate_s3_cache()
+                print(f"\n== {engine}, {size} plants ==")
+                print(f"{'scenario':<28}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'peak MB':>10}")
+                for name, result in run_scenarios(app, storage._storage, size, args.iterations).items():
+                    results[f"{engine}/{size}/{name}"] = result
+                    print(f"{name:<28}{result['p50']:>10.2f}{result['p90']:>10.2f}{result['p99']:>10.2f}"
+                          f"{result['ops_per_s']:>10.1f}{result['peak_mb']:>10.1f}")
+    finally:
+        server.shutdown()
+        if mock:
+            mock.stop()
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=4)
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            regressions = compare(results, json.load(file), args.max_regression, args.min_delta_ms)
+        if regressions:
+            print("\nRegressions against the baseline:\n" + "\n".join(regressions))
+            sys.exit(1)
+        print("\nNo regressions against the baseline.")
+
+
+if __name__ == '__main__':
+    main()
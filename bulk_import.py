@@ -0,0 +1,107 @@
+"""
+Helpers for /bulk-import: reading the uploaded list of plants and resolving watering for all of them
+concurrently, without going over the API rate limit.
+"""
+
+import io
+import os
+import csv
+import json
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import RetryableAPIError, api_limiter
+from api_cache import normalize_query
+
+BULK_WORKERS = int(os.environ.get('SAKURA_BULK_WORKERS', '8'))
+BULK_RATE = float(os.environ.get('SAKURA_BULK_RATE', '5'))  # API calls per second
+BULK_RETRIES = int(os.environ.get('SAKURA_BULK_RETRIES', '4'))
+BACKOFF_BASE = 0.5  # seconds, doubled on every retry
+
+
+def parse_bulk_payload(text, filename='', default_position=None):
+    """
+    Plants to import from a JSON list (or {"plants": [...]}) of {"name"/"plant_name", "position"}
+    objects, or from CSV with a name,position header. Returns (rows, errors).
+    """
+    text = text.strip()
+    if filename.lower().endswith('.json') or text[:1] in '[{':
+        data = json.loads(text)
+        entries = data['plants'] if isinstance(data, dict) else data
+    else:
+        entries = list(csv.DictReader(io.StringIO(text)))
+
+    rows, errors = [], []
+    for line, entry in enumerate(entries, 1):
+        if isinstance(entry, str):
+            entry = {'name': entry}
+        name = (entry.get('name') or entry.get('plant_name') or '').strip()
+        position = entry.get('position', default_position)
+        try:
+            position = int(position)
+        except (TypeError, ValueError):
+            errors.append({'row': line, 'name': name, 'reason': f"invalid position: {position!r}"})
+            continue
+        if not name:
+            errors.append({'row': line, 'name': name, 'reason': "missing plant name"})
+        elif position not in range(4):
+            errors.append({'row': line, 'name': name, 'reason': f"position must be 0-3, got {position}"})
+        else:
+            rows.append({'name': name, 'position': position})
+    return rows, errors
+
+
+class RateLimiter:
+    """Token bucket shared by the worker threads: at most `rate` calls per second, bursts of `burst`."""
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+def resolve_watering_many(names, lookup, local_lookup=None, workers=BULK_WORKERS, rate=BULK_RATE,
+                          retries=BULK_RETRIES):
+    """
+    Runs lookup(name) for every distinct name on a thread pool and returns {normalized name: result}.
+    Names local_lookup (e.g. the offline catalog) can answer skip the API. Every API request the
+    lookups make, however many per name, waits for the shared rate limiter (backend.api_limiter);
+    RetryableAPIError is retried with exponential backoff and jitter, and after the last attempt the
+    result for that name is the exception.
+    """
+    limiter = RateLimiter(rate)
+
+    def resolve(name):
+        api_limiter.set(limiter)  # this worker thread's context, passed on to the lookup threads
+        if local_lookup is not None:
+            result = local_lookup(name)
+            if result is not None:
+                return result
+        for attempt in range(retries + 1):
+            try:
+                return lookup(name)
+            except RetryableAPIError as e:
+                if attempt == retries:
+                    return e
+                time.sleep(BACKOFF_BASE * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    unique_names = list(dict.fromkeys(normalize_query(name) for name in names))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        return dict(zip(unique_names, executor.map(resolve, unique_names)))
@@ -0,0 +1,162 @@
+"""
+Offline copy of the Perenual species list, so adding a plant is a local lookup instead of an API call.
+
+`python catalog.py harvest` walks every page of the species list (pages already in the API cache are
+not fetched again, so an interrupted harvest picks up where it stopped) and writes a compact catalog
+to perenual_jsons/catalog.json. get_watering asks the catalog first and only goes to the network
+when it has no confident match.
+"""
+
+import os
+import re
+import json
+import bisect
+import argparse
+import threading
+from difflib import SequenceMatcher
+
+from species_lookup import normalize_watering
+
+CATALOG_PATH = os.environ.get('SAKURA_CATALOG_PATH', 'perenual_jsons/catalog.json')
+FUZZY_CUTOFF = 0.85  # SequenceMatcher ratio a misspelt query needs to be trusted
+
+
+def normalize_name(name):
+    return ' '.join(re.sub(r'[^a-z0-9]+', ' ', (name or '').lower()).split())
+
+
+def harvest_catalog(path=CATALOG_PATH, max_pages=None):
+    """Pulls the species list page by page into a catalog file, returns the number of species."""
+    from backend import perenual_pull_species_list
+
+    species = []
+    page, last_page = 1, 1
+    while page <= last_page and (max_pages is None or page <= max_pages):
+        data = perenual_pull_species_list(page)
+        if data is None:
+            print(f"Stopped harvesting at page {page}, run it again later to continue from there.")
+            break
+        last_page = data.get('last_page', page)
+        for plant in data['data']:
+            names = [plant.get('common_name')] + (plant.get('scientific_name') or []) + (plant.get('other_name') or [])
+            names = list(dict.fromkeys(normalize_name(name) for name in names if normalize_name(name)))
+            if names:
+                species.append([plant['id'], plant.get('watering'), names])
+        page += 1
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as file:
+        json.dump({'fields': ['id', 'watering', 'names'], 'species': species}, file, separators=(',', ':'))
+    print(f"Saved {len(species)} species from {page - 1} of {last_page} pages to {path}")
+    return len(species)
+
+
+class SpeciesCatalog:
+    """
+    Search index over the catalog: every normalized name, a token -> names map for whole-word
+    matches, a sorted token list for prefix matches, and fuzzy matching limited to names that
+    share a token prefix with the query so it never compares against the whole catalog.
+    """
+    def __init__(self, species):
+        self.species = species  # [id, watering, names]
+        self.names = []  # (name, species index)
+        self.exact = {}
+        self.token_names = {}
+        for index, (_, _, names) in enumerate(species):
+            for name in names:
+                name_index = len(self.names)
+                self.names.append((name, index))
+                self.exact.setdefault(name, []).append(index)
+                for token in name.split():
+                    self.token_names.setdefault(token, set()).add(name_index)
+        self.tokens = sorted(self.token_names)
+
+    @classmethod
+    def load(cls, path=CATALOG_PATH):
+        with open(path, 'r') as file:
+            return cls(json.load(file)['species'])
+
+    def _names_with_prefix(self, prefix):
+        matches = set()
+        position = bisect.bisect_left(self.tokens, prefix)
+        while position < len(self.tokens) and self.tokens[position].startswith(prefix):
+            matches |= self.token_names[self.tokens[position]]
+            position += 1
+        return matches
+
+    def search(self, query, limit=10):
+        """Best matching species for query as (species, score) pairs, highest score first."""
+        query = normalize_name(query)
+        if not query:
+            return []
+        if query in self.exact:
+            return [(self.species[index], 1.0) for index in self.exact[query][:limit]]
+
+        # Every query word has to start a word of the name, "snake pl" finds "snake plant"
+        tokens = query.split()
+        candidates = self._names_with_prefix(tokens[0])
+        for token in tokens[1:]:
+            candidates &= self._names_with_prefix(token)
+        if not candidates:
+            # Nothing matched word by word, so compare against names sharing a short prefix instead
+            candidates = set()
+            for token in tokens:
+                candidates |= self._names_with_prefix(token[:3])
+
+        best = {}
+        for name_index in candidates:
+            name, index = self.names[name_index]
+            score = SequenceMatcher(None, query, name).ratio()
+            if score > best.get(index, 0):
+                best[index] = score
+        ranked = sorted(best.items(), key=lambda item: -item[1])[:limit]
+        return [(self.species[index], score) for index, score in ranked]
+
+    def watering(self, query):
+        """
+        Watering class of the species query most likely means, or None if there's no confident
+        match or its stored value isn't one of the four classes (e.g. the paid-plan placeholder).
+        """
+        matches = self.search(query)
+        if not matches:
+            return None
+        (_, watering, names), score = matches[0]
+        if score >= FUZZY_CUTOFF or query_words_match(query, names):
+            return normalize_watering(watering)
+        return None
+
+
+def query_words_match(query, names):
+    words = normalize_name(query).split()
+    return any(all(any(token.startswith(word) for token in name.split()) for word in words) for name in names)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+def get_catalog():
+    """The catalog from CATALOG_PATH, loaded once; None if it hasn't been harvested."""
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None and os.path.exists(CATALOG_PATH):
+            _catalog = SpeciesCatalog.load(CATALOG_PATH)
+        return _catalog
+
+def lookup_watering(query):
+    catalog = get_catalog()
+    return catalog.watering(query) if catalog else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sakura offline species catalog")
+    commands = parser.add_subparsers(dest='command', required=True)
+    harvest_parser = commands.add_parser('harvest', help="download the Perenual species list into the catalog")
+    harvest_parser.add_argument('--max-pages', type=int, default=None)
+    search_parser = commands.add_parser('search', help="look a name up in the catalog")
+    search_parser.add_argument('query')
+    args = parser.parse_args()
+
+    if args.command == 'harvest':
+        harvest_catalog(max_pages=args.max_pages)
+    elif args.command == 'search':
+        for (species_id, watering, names), score in SpeciesCatalog.load().search(args.query):
+            print(f"{score:.2f}  {species_id}  {watering}  {', '.join(names)}")
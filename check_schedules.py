@@ -0,0 +1,80 @@
+"""
+Checks schedule.compute_schedules against the per-plant loops the home page used before it:
+`python check_schedules.py` draws random plants (date_added in the past and the future) and exits
+non-zero when the next water/food/repotting dates or the food/repotting flags differ anywhere.
+"""
+
+import sys
+import random
+import argparse
+from datetime import date, datetime, timedelta
+
+from schedule import MONTH_DAYS, compute_schedules
+
+
+# The original helpers, as they were in app.py; now is a datetime during the day, like datetime.today()
+def old_next_water_date(now, date_added, water_schedule):
+    date_added = datetime.strptime(date_added, "%Y-%m-%d")
+    days_since_added = (now - date_added).days
+    days_until_next_water = water_schedule - (days_since_added % water_schedule)
+    return (now + timedelta(days=days_until_next_water)).strftime("%Y-%m-%d")
+
+def old_next_event_date(now, date_added, schedule):
+    date_added = datetime.strptime(date_added, "%Y-%m-%d")
+    period = timedelta(days=schedule * MONTH_DAYS)
+    next_event_date = date_added
+    while next_event_date < now:
+        next_event_date += period
+    return next_event_date
+
+def old_is_event_today_or_tomorrow(now, date_added, schedule):
+    if schedule == 0:
+        return False
+    return old_next_event_date(now, date_added, schedule) <= (now + timedelta(days=1))
+
+
+def random_plants(count, today, seed=0):
+    rng = random.Random(seed)
+    return [{
+        'date_added': (today + timedelta(days=rng.randint(-3 * 365, 90))).isoformat(),
+        'water_schedule': rng.randint(1, 30),  # 0 made the old helper divide by zero
+        'food_schedule': rng.choice([0, 1, 2, 3, 6]),
+        'repotting_schedule': rng.choice([0, 6, 12]),
+    } for _ in range(count)]
+
+def compare(plants, today):
+    """Descriptions of every plant where the two disagree."""
+    now = datetime.combine(today, datetime.min.time()) + timedelta(hours=12)
+    schedules = compute_schedules([plant['date_added'] for plant in plants],
+                                  [plant['water_schedule'] for plant in plants],
+                                  [plant['food_schedule'] for plant in plants],
+                                  [plant['repotting_schedule'] for plant in plants], today)
+    new = {name: values.astype(object).tolist() for name, values in schedules.items()}
+    mismatches = []
+    for row, plant in enumerate(plants):
+        expected = {
+            'next_water': date.fromisoformat(old_next_water_date(now, plant['date_added'], plant['water_schedule'])),
+            'food_event': old_is_event_today_or_tomorrow(now, plant['date_added'], plant['food_schedule']),
+            'repotting_event': old_is_event_today_or_tomorrow(now, plant['date_added'], plant['repotting_schedule']),
+        }
+        for kind in ('food', 'repotting'):
+            schedule = plant[f'{kind}_schedule']
+            expected[f'next_{kind}'] = old_next_event_date(now, plant['date_added'], schedule).date() if schedule else None
+        for name, value in expected.items():
+            if new[name][row] != value:
+                mismatches.append(f"{plant}: {name} is {new[name][row]}, the old loop gives {value}")
+    return mismatches
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Compare the vectorized care schedules with the old loops")
+    parser.add_argument('--count', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    today = date.today()
+    mismatches = compare(random_plants(args.count, today, args.seed), today)
+    for mismatch in mismatches[:20]:
+        print(mismatch)
+    print(f"{args.count} plants, {len(mismatches)} differences")
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,45 @@
+"""
+Import-time budget for the app: `python check_startup.py` imports it in fresh interpreters, reports
+the best of several runs and exits non-zero when it is over SAKURA_IMPORT_BUDGET_MS or when one of
+the heavy dependencies that should only load on first use was imported.
+"""
+
+import os
+import sys
+import json
+import subprocess
+
+IMPORT_BUDGET_MS = float(os.environ.get('SAKURA_IMPORT_BUDGET_MS', '600'))
+DEFERRED_MODULES = ['dash', 'pandas', 'numpy', 'boto3', 'botocore', 'requests']
+RUNS = 5
+
+PROBE = """
+import sys, time, json
+start = time.perf_counter()
+import app
+elapsed = (time.perf_counter() - start) * 1000
+print(json.dumps({'ms': elapsed, 'loaded': [name for name in %r if name in sys.modules]}))
+""" % (DEFERRED_MODULES,)
+
+
+def measure_import(runs=RUNS):
+    """Best import time of `app` in milliseconds over runs, and deferred modules it loaded anyway."""
+    results = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__)))
+        results.append(json.loads(output.stdout.strip().splitlines()[-1]))
+    return min(result['ms'] for result in results), sorted({name for result in results for name in result['loaded']})
+
+
+if __name__ == '__main__':
+    best_ms, loaded = measure_import()
+    print(f"import app: {best_ms:.0f} ms (budget {IMPORT_BUDGET_MS:.0f} ms)")
+    failed = False
+    if best_ms > IMPORT_BUDGET_MS:
+        print("Over the import-time budget!")
+        failed = True
+    if loaded:
+        print(f"Imported at startup but should be deferred: {', '.join(loaded)}")
+        failed = True
+    sys.exit(1 if failed else 0)
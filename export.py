@@ -0,0 +1,127 @@
+"""
+Generators behind the /export endpoints: the plant collection as NDJSON or CSV, and the care
+calendar (the next few water/food/repotting dates of every plant) as NDJSON, CSV or iCalendar.
+
+Everything is produced row by row from an iterable of plants, so the response starts streaming
+right away and memory doesn't grow with the collection or the number of dates asked for. The
+calendar is computed CHUNK plants at a time with schedule.compute_schedules, with the same rules
+as the home page: the next watering is 1 to water_schedule days away, food and repotting dates
+are date_added plus whole periods of 30-day months. Plants that are never watered (NO_WATERING) have
+no watering events, and a series stops early rather than run past the last representable date.
+"""
+
+import io
+import csv
+import json
+from datetime import date, datetime, timedelta, timezone
+from itertools import islice
+
+from schedule import MONTH_DAYS, NO_WATERING, EVENT_KINDS, compute_schedules
+
+CHUNK = 1000  # plants per vectorized schedule computation
+FLUSH_BYTES = 64 * 1024  # rows are sent in pieces of about this size, not one write per row
+CALENDAR_FIELDS = ['date', 'kind', 'id', 'name', 'position']
+EVENT_VERBS = {'water': "Water", 'food': "Feed", 'repotting': "Repot"}
+
+
+def chunks(iterable, size=CHUNK):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+def care_calendar(plants, count=5, today=None):
+    """
+    Yields {date, kind, id, name, position} for the next count water, food and repotting dates of
+    every plant, plant by plant. Schedules of 0 have no events.
+    """
+    today = today or date.today()
+    for chunk in chunks(plants):
+        schedules = compute_schedules(
+            [plant['date_added'] for plant in chunk],
+            [int(plant['water_schedule']) for plant in chunk],
+            [int(plant['food_schedule']) for plant in chunk],
+            [int(plant['repotting_schedule']) for plant in chunk],
+            today)
+        next_dates = {kind: schedules[f'next_{kind}'].astype(object) for kind in EVENT_KINDS}
+        for row, plant in enumerate(chunk):
+            periods = {'water': int(plant['water_schedule']),
+                       'food': int(plant['food_schedule']) * MONTH_DAYS,
+                       'repotting': int(plant['repotting_schedule']) * MONTH_DAYS}
+            for kind in EVENT_KINDS:
+                first = next_dates[kind][row]
+                if first is None or (kind == 'water' and periods[kind] >= NO_WATERING):
+                    continue
+                # date.max is ~8000 years off, a long enough period times count can still pass it
+                occurrences = min(count, (date.max - first).days // periods[kind] + 1)
+                for number in range(occurrences):
+                    yield {'date': (first + timedelta(days=periods[kind] * number)).isoformat(), 'kind': kind,
+                           'id': plant['id'], 'name': plant['name'], 'position': plant['position']}
+
+
+def batched(lines):
+    pending, size = [], 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= FLUSH_BYTES:
+            yield ''.join(pending)
+            pending, size = [], 0
+    if pending:
+        yield ''.join(pending)
+
+def ndjson_lines(records):
+    return batched(json.dumps(record) + '\n' for record in records)
+
+def csv_lines(records, fields):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+    writer.writeheader()
+    for record in records:
+        writer.writerow(record)
+        if buffer.tell() >= FLUSH_BYTES:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ical_text(text):
+    return text.replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\n', '\\n')
+
+def ical_line(line):
+    # Content lines are folded at 75 octets, continuation lines start with a space (RFC 5545 3.1)
+    encoded = line.encode('utf-8')
+    if len(encoded) <= 75:
+        return line + '\r\n'
+    parts, start, limit = [], 0, 75
+    while start < len(encoded):
+        end = min(start + limit, len(encoded))
+        while end < len(encoded) and (encoded[end] & 0xC0) == 0x80:  # don't split a UTF-8 character
+            end -= 1
+        parts.append(encoded[start:end].decode('utf-8'))
+        start, limit = end, 74
+    return '\r\n '.join(parts) + '\r\n'
+
+def ical_lines(events, panel_titles=None):
+    return batched(ical_events(events, panel_titles))
+
+def ical_events(events, panel_titles):
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    yield ical_line('BEGIN:VCALENDAR') + ical_line('VERSION:2.0') + ical_line('PRODID:-//Sakura//Care calendar//EN')
+    for event in events:
+        day = event['date'].replace('-', '')
+        where = (panel_titles or {}).get(event['position'], f"position {event['position']}")
+        yield ''.join(ical_line(line) for line in [
+            'BEGIN:VEVENT',
+            f"UID:{event['id']}-{event['kind']}-{day}@sakura",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART;VALUE=DATE:{day}",
+            f"SUMMARY:{ical_text(EVENT_VERBS[event['kind']] + ' ' + event['name'])}",
+            f"LOCATION:{ical_text(where)}",
+            'TRANSP:TRANSPARENT',
+            'END:VEVENT',
+        ])
+    yield ical_line('END:VCALENDAR')
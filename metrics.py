@@ -0,0 +1,147 @@
+"""
+Timing spans for the hot paths, exported at /metrics in the Prometheus text format.
+
+Wrap a phase in `with span('s3_get'):` or decorate a function with `@timed('s3_read')`; every span
+is observed into a histogram labelled with its name. While a request is being profiled (see
+PROFILE_HEADER) the spans it went through are also collected for the Server-Timing header.
+"""
+
+import os
+import sys
+import time
+import bisect
+import threading
+import functools
+import contextvars
+from contextlib import contextmanager
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+PROFILE_HEADER = 'X-Sakura-Profile'  # "1" for Server-Timing, "cprofile" for a cProfile report
+PROFILING = os.environ.get('SAKURA_PROFILING', '0') == '1'  # opt-in, the header is ignored otherwise
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last one is +Inf
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}  # (metric name, ((label, value), ...)) -> Histogram
+        self.help = {}
+
+    def describe(self, name, text):
+        self.help[name] = text
+
+    def observe(self, name, labels, seconds):
+        with self.lock:
+            key = (name, tuple(labels))
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name in sorted({name for name, _ in self.histograms}):
+                lines += [f"# HELP {name} {self.help.get(name, name)}", f"# TYPE {name} histogram"]
+                for (metric, labels), histogram in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{format_labels(labels + (('le', str(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{format_labels(labels)} {histogram.total}")
+                    lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+        return lines
+
+
+def format_labels(labels):
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{label}="{value}"' for (label, _), value in zip(labels, escaped)) + '}'
+
+
+registry = Registry()
+registry.describe('sakura_span_seconds', "Time spent in each instrumented phase")
+registry.describe('sakura_request_seconds', "Time spent handling HTTP requests")
+
+_request_spans = contextvars.ContextVar('sakura_request_spans', default=None)
+
+
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        registry.observe('sakura_span_seconds', (('span', name),), seconds)
+        spans = _request_spans.get()
+        if spans is not None:
+            spans.append((name, seconds))
+
+def timed(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def start_request_profile():
+    """Starts collecting the spans of the current request, returns the token for finish_request_profile."""
+    return _request_spans.set([])
+
+def finish_request_profile(token):
+    spans = _request_spans.get()
+    _request_spans.reset(token)
+    return spans or []
+
+def server_timing(spans):
+    """Server-Timing header value with the total duration of each span name, in first-seen order."""
+    totals, calls = {}, {}
+    for name, seconds in spans:
+        totals[name] = totals.get(name, 0.0) + seconds
+        calls[name] = calls.get(name, 0) + 1
+    return ', '.join(f'{name};dur={seconds * 1000:.2f}' + (f';desc="{calls[name]} calls"' if calls[name] > 1 else '')
+                     for name, seconds in totals.items())
+
+
+def provider_metrics_lines():
+    # Only once provider_client is in use: importing it here would pull requests into startup
+    provider_client = sys.modules.get('provider_client')
+    client = getattr(provider_client, '_client', None)
+    if client is None:
+        return []
+    snapshot = client.metrics.snapshot()
+    lines = ["# HELP sakura_provider_calls_total Plant API calls by provider",
+             "# TYPE sakura_provider_calls_total counter"]
+    lines += [f'sakura_provider_calls_total{{provider="{provider}"}} {stats["calls"]}'
+              for provider, stats in snapshot.items()]
+    lines += ["# HELP sakura_provider_seconds_total Time spent in plant API calls by provider",
+              "# TYPE sakura_provider_seconds_total counter"]
+    lines += [f'sakura_provider_seconds_total{{provider="{provider}"}} {stats["seconds"]}'
+              for provider, stats in snapshot.items()]
+    lines += ["# HELP sakura_provider_responses_total Plant API responses by status code or error",
+              "# TYPE sakura_provider_responses_total counter"]
+    lines += [f'sakura_provider_responses_total{{provider="{provider}",status="{status}"}} {count}'
+              for provider, stats in snapshot.items() for status, count in stats['statuses'].items()]
+    lines += ["# HELP sakura_provider_latency_seconds Recent plant API call latency",
+              "# TYPE sakura_provider_latency_seconds summary"]
+    lines += [f'sakura_provider_latency_seconds{{provider="{provider}",quantile="0.{q}"}} {stats[f"p{q}"]}'
+              for provider, stats in snapshot.items() for q in (50, 90, 99)]
+    return lines
+
+def render_prometheus():
+    return '\n'.join(registry.render() + provider_metrics_lines()) + '\n'
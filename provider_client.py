@@ -0,0 +1,107 @@
+"""
+HTTP client shared by every Perenual and Trefle call in backend.py.
+
+One requests.Session with a connection pool keeps TCP/TLS connections alive between lookups, every
+request has a connect/read timeout, and connection errors and 5xx answers are retried with backoff.
+Latency and status codes are recorded per provider. Tests (and the benchmarks) can point the
+client at a local stub server with set_provider_client(ProviderClient(base_urls={...})).
+"""
+
+import os
+import time
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BASE_URLS = {
+    'perenual': os.environ.get('PERENUAL_BASE_URL', 'https://perenual.com/api'),
+    'trefle': os.environ.get('TREFLE_BASE_URL', 'https://trefle.io/api/v1'),
+}
+CONNECT_TIMEOUT = float(os.environ.get('SAKURA_HTTP_CONNECT_TIMEOUT', '3'))
+READ_TIMEOUT = float(os.environ.get('SAKURA_HTTP_READ_TIMEOUT', '10'))
+HTTP_RETRIES = int(os.environ.get('SAKURA_HTTP_RETRIES', '2'))
+POOL_SIZE = int(os.environ.get('SAKURA_HTTP_POOL_SIZE', '16'))
+LATENCY_SAMPLES = 1000  # most recent calls kept per provider for percentiles
+
+
+class ProviderMetrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}  # provider -> count
+        self.statuses = {}  # (provider, status code or exception name) -> count
+        self.seconds = {}  # provider -> total seconds
+        self.latencies = {}  # provider -> recent latencies
+
+    def record(self, provider, status, seconds):
+        with self.lock:
+            self.calls[provider] = self.calls.get(provider, 0) + 1
+            self.statuses[(provider, status)] = self.statuses.get((provider, status), 0) + 1
+            self.seconds[provider] = self.seconds.get(provider, 0.0) + seconds
+            self.latencies.setdefault(provider, deque(maxlen=LATENCY_SAMPLES)).append(seconds)
+
+    def snapshot(self):
+        """Per provider: calls, statuses, total seconds and p50/p90/p99 of the recent latencies."""
+        with self.lock:
+            summary = {}
+            for provider, calls in self.calls.items():
+                latencies = sorted(self.latencies[provider])
+                summary[provider] = {
+                    'calls': calls,
+                    'seconds': self.seconds[provider],
+                    'statuses': {str(status): count for (name, status), count in self.statuses.items()
+                                 if name == provider},
+                    **{f'p{q}': latencies[min(len(latencies) - 1, int(len(latencies) * q / 100))]
+                       for q in (50, 90, 99)},
+                }
+            return summary
+
+
+class ProviderClient:
+    def __init__(self, base_urls=None, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), retries=HTTP_RETRIES,
+                 pool_size=POOL_SIZE):
+        self.base_urls = {**BASE_URLS, **(base_urls or {})}
+        self.timeout = timeout
+        self.metrics = ProviderMetrics()
+        self.session = requests.Session()
+        # 429 is left to the caller (see bulk_import), retrying it here would only burn more quota
+        retry = Retry(total=retries, backoff_factor=0.3, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=['GET'], raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=len(self.base_urls), pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def url(self, provider, path):
+        return self.base_urls[provider].rstrip('/') + '/' + path.lstrip('/')
+
+    def get(self, provider, path, params=None):
+        """GET path on provider's API. Raises requests.RequestException on timeouts and connection errors."""
+        return self.get_url(provider, self.url(provider, path), params)
+
+    def get_url(self, provider, url, params=None):
+        start = time.perf_counter()
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+        except requests.RequestException as e:
+            self.metrics.record(provider, type(e).__name__, time.perf_counter() - start)
+            raise
+        self.metrics.record(provider, response.status_code, time.perf_counter() - start)
+        return response
+
+
+_client = None
+_client_lock = threading.Lock()
+def get_provider_client():
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ProviderClient()
+        return _client
+
+def set_provider_client(client):
+    """Swaps the client every provider call goes through, e.g. for one pointed at a stub server."""
+    global _client
+    with _client_lock:
+        _client = client
@@ -0,0 +1,156 @@
+"""
+Compact in-memory plant records shared by the storage cache and the page rendering.
+
+A PlantRecord keeps the nine stored fields in __slots__, with date_added as a date ordinal, so a
+large cached collection costs a fraction of the per-plant dicts it replaces. Records still answer
+plant['name'] (and plant.name in templates), so code written for dicts keeps working; to_dict()
+gives the stored form back, including any other fields the stored plant had (kept in extras).
+PlantCollection indexes a set of records by id, by position and, once asked for, by name prefix.
+Values computed from a record (next watering, events) are kept apart in PlantCare, never written
+onto the record itself.
+"""
+
+import copy
+from datetime import date
+
+FIELDS = ('id', 'position', 'name', 'date_added', 'water_schedule', 'food_schedule',
+          'repotting_schedule', 'temperature_min', 'temperature_max')
+
+
+class PlantRecord:
+    __slots__ = ('id', 'position', 'name', 'day', 'water_schedule', 'food_schedule', 'repotting_schedule',
+                 'temperature_min', 'temperature_max', 'extras')
+
+    def __init__(self, id, position, name, day, water_schedule, food_schedule, repotting_schedule,
+                 temperature_min=None, temperature_max=None, extras=None):
+        self.id = id
+        self.position = position
+        self.name = name
+        self.day = day  # date_added as date.toordinal()
+        self.water_schedule = water_schedule
+        self.food_schedule = food_schedule
+        self.repotting_schedule = repotting_schedule
+        self.temperature_min = temperature_min
+        self.temperature_max = temperature_max
+        self.extras = extras  # {field: value} of fields outside FIELDS, None for most plants
+
+    @classmethod
+    def from_dict(cls, plant):
+        return cls(plant['id'], plant['position'], plant['name'], date.fromisoformat(plant['date_added']).toordinal(),
+                   plant['water_schedule'], plant['food_schedule'], plant['repotting_schedule'],
+                   plant.get('temperature_min'), plant.get('temperature_max'),
+                   {field: value for field, value in plant.items() if field not in FIELDS} or None)
+
+    @property
+    def date_added(self):
+        return date.fromordinal(self.day).isoformat()
+
+    def to_dict(self):
+        plant = {field: getattr(self, field) for field in FIELDS}
+        if self.extras:
+            plant.update(copy.deepcopy(self.extras))  # callers may change the dict, not the cache
+        return plant
+
+    def __getitem__(self, field):
+        if field in FIELDS:
+            return getattr(self, field)
+        if self.extras and field in self.extras:
+            return self.extras[field]
+        raise KeyError(field)
+
+    def get(self, field, default=None):
+        try:
+            return self[field]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        return isinstance(other, PlantRecord) and all(getattr(self, slot) == getattr(other, slot) for slot in self.__slots__)
+
+    def __repr__(self):
+        return f"PlantRecord({self.to_dict()!r})"
+
+
+class NameTrie:
+    """
+    Lowercased names one character per level, ids stored under the '' key where a name ends. A
+    prefix lookup walks down the prefix and then only the subtree below it, so it costs about the
+    length of the matching names, not the size of the collection.
+    """
+    def __init__(self):
+        self.root = {}
+
+    def add(self, name, plant_id):
+        node = self.root
+        for character in name.lower():
+            node = node.setdefault(character, {})
+        node.setdefault('', []).append(plant_id)
+
+    def with_prefix(self, prefix):
+        node = self.root
+        for character in prefix.lower():
+            node = node.get(character)
+            if node is None:
+                return []
+        plant_ids, stack = [], [node]
+        while stack:
+            node = stack.pop()
+            for character, child in node.items():
+                if character == '':
+                    plant_ids.extend(child)
+                else:
+                    stack.append(child)
+        return plant_ids
+
+
+class PlantCollection:
+    """Records in storage order, with an id index and a list per position, built once per data version."""
+    def __init__(self, records=()):
+        self.records = list(records)
+        self.by_id = {record.id: record for record in self.records}
+        self.positions = {}
+        for record in self.records:
+            self.positions.setdefault(record.position, []).append(record)
+        self._names = None
+
+    @property
+    def names(self):
+        # Only built for collections that get searched by name, then kept with them
+        if self._names is None:
+            names = NameTrie()
+            for record in self.records:
+                names.add(record.name, record.id)
+            self._names = names
+        return self._names
+
+    @classmethod
+    def from_dicts(cls, plants):
+        return cls(PlantRecord.from_dict(plant) for plant in plants)
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def get(self, plant_id):
+        return self.by_id.get(plant_id)
+
+    def at(self, position):
+        return self.positions.get(position, [])
+
+    def by_positions(self, positions):
+        return {position: self.at(position) for position in positions}
+
+    def to_dicts(self):
+        return [record.to_dict() for record in self.records]
+
+
+class PlantCare:
+    """What the home page shows next to a plant, derived from its record and the day."""
+    __slots__ = ('next_water', 'food_event', 'repotting_event')
+
+    def __init__(self, next_water, food_event, repotting_event):
+        self.next_water = next_water
+        self.food_event = food_event
+        self.repotting_event = repotting_event
@@ -0,0 +1,153 @@
+"""
+Daily care lists, computed in the background instead of on page loads.
+
+A ReminderScheduler recomputes what is due per position once a day, right after midnight, and
+shortly after every edit, and saves it to SAKURA_REMINDERS_PATH where the /reminders endpoint and
+any notification consumer read it. It runs as a thread inside the app (SAKURA_REMINDERS=thread, the
+default) or as its own process, which notices edits by polling the storage version:
+
+    python reminders.py           # worker, keeps the file up to date
+    python reminders.py --once    # compute and save once, e.g. from cron
+"""
+
+import os
+import json
+import time
+import argparse
+import threading
+from datetime import date, datetime, timedelta
+
+from schedule import EventIndex, events_on
+
+REMINDERS_PATH = os.environ.get('SAKURA_REMINDERS_PATH', 'reminders.json')
+REMINDER_MODE = os.environ.get('SAKURA_REMINDERS', 'thread')  # thread, worker (separate process) or off
+HORIZON_DAYS = int(os.environ.get('SAKURA_REMINDER_HORIZON_DAYS', '1'))  # events up to tomorrow by default
+POLL_SECONDS = float(os.environ.get('SAKURA_REMINDER_POLL', '60'))  # how often storage is checked for edits
+DEBOUNCE_SECONDS = 2.0  # bulk edits trigger one recomputation, not one each
+
+
+def compute_due_lists(plants, today=None, index=None, version=None):
+    """
+    Events from today to today + HORIZON_DAYS, grouped by position:
+    {"date", "generated_at", "version", "positions": {position: [{"id", "name", "kind", "due"}]}}.
+    """
+    today = today or date.today()
+    index = (index or EventIndex()).sync(plants, today, version)
+    by_id = {plant['id']: plant for plant in plants}
+    positions = {}
+    # The index starts the day after today, today's own events are worked out separately
+    due_events = [(today, plant_id, kind) for plant_id, kind in sorted(events_on(plants, today))]
+    due_events += index.due_between(today + timedelta(days=1), today + timedelta(days=HORIZON_DAYS))
+    for due, plant_id, kind in due_events:
+        plant = by_id.get(plant_id)
+        if plant is None:  # index is shared with the app and has seen a newer collection
+            continue
+        positions.setdefault(str(plant['position']), []).append(
+            {'id': plant_id, 'name': plant['name'], 'kind': kind, 'due': due.isoformat()})
+    return {'date': today.isoformat(), 'generated_at': datetime.now().isoformat(timespec='seconds'),
+            'version': None if version is None else str(version), 'positions': positions}
+
+def save_due_lists(due_lists, path=REMINDERS_PATH):
+    # Written next to the target and renamed over it, readers never see half a file
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w') as file:
+        json.dump(due_lists, file, indent=4)
+    os.replace(temporary_path, path)
+
+def load_due_lists(path=REMINDERS_PATH):
+    try:
+        with open(path, 'r') as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def seconds_until_midnight(now=None):
+    now = now or datetime.now()
+    return (datetime.combine(now.date() + timedelta(days=1), datetime.min.time()) - now).total_seconds()
+
+
+class ReminderScheduler:
+    """
+    Keeps the saved due lists current: recomputes when the day changes, when trigger() is called
+    after an edit and, with poll=True, when the storage version changed underneath it (edits made
+    by other processes). The day is read from the clock on every wake-up, never cached, so a
+    process that stays up past midnight moves on to the new day's list.
+    """
+    def __init__(self, get_storage, path=REMINDERS_PATH, index=None, poll=False):
+        self.get_storage = get_storage
+        self.path = path
+        self.index = index or EventIndex()
+        self.poll = poll
+        self.triggered = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.last = {'date': None, 'version': None}
+        self.lock = threading.Lock()
+
+    def run_once(self, today=None):
+        with self.lock:
+            storage = self.get_storage()
+            plants = storage.read_all()
+            if plants is None:
+                print("Could not read plants, keeping the previous reminders")
+                return None
+            version = storage.version()
+            due_lists = compute_due_lists(plants, today, self.index, version)
+            save_due_lists(due_lists, self.path)
+            self.last = {'date': due_lists['date'], 'version': version}
+            return due_lists
+
+    def trigger(self):
+        """Asks for a recomputation soon, called after every edit."""
+        self.triggered.set()
+
+    def is_stale(self):
+        if self.last['date'] != date.today().isoformat():
+            return True
+        if self.poll:
+            storage = self.get_storage()
+            storage.read_all()  # engines that cache (s3) only learn about other writers on a read
+            return storage.version() is None or storage.version() != self.last['version']
+        return False
+
+    def loop(self):
+        while not self.stopped.is_set():
+            try:
+                if self.triggered.is_set() or self.is_stale():
+                    if self.triggered.is_set():
+                        time.sleep(DEBOUNCE_SECONDS)
+                        self.triggered.clear()
+                    self.run_once()
+            except Exception as e:  # keep going, the next wake-up tries again
+                print(f"Reminder update failed: {e}")
+            # Wakes up at midnight, on trigger() or to poll; short waits also survive clock jumps
+            timeout = min(seconds_until_midnight() + 1, POLL_SECONDS if self.poll else 300)
+            self.triggered.wait(timeout)
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.loop, name='reminders', daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.triggered.set()
+
+
+if __name__ == '__main__':
+    from storage import get_storage
+
+    parser = argparse.ArgumentParser(description="Sakura care reminder worker")
+    parser.add_argument('--once', action='store_true', help="compute and save the due lists once, then exit")
+    args = parser.parse_args()
+
+    scheduler = ReminderScheduler(get_storage, poll=True)
+    if args.once:
+        due_lists = scheduler.run_once()
+        if due_lists is not None:
+            print(f"Saved {sum(map(len, due_lists['positions'].values()))} reminders for {due_lists['date']} to {scheduler.path}")
+    else:
+        print(f"Keeping {scheduler.path} up to date, Ctrl+C to stop")
+        scheduler.loop()
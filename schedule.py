@@ -0,0 +1,211 @@
+"""
+Closed-form care schedule computations for a whole collection at once.
+
+Events repeat every `schedule` days (water) or `schedule * 30` days (food, repotting) counted from
+date_added, so the next one is a modulo away instead of a loop stepping forward period by period.
+The rules match the original per-plant helpers exactly (python check_schedules.py compares them):
+  - watering repeats in both directions from date_added, and the next watering is always 1 to
+    water_schedule days after today, never today itself;
+  - food/repotting events start at date_added and flag a plant when the first event after today
+    falls on tomorrow. A schedule of 0 means never.
+"""
+
+import bisect
+import threading
+from datetime import date, timedelta
+
+MONTH_DAYS = 30  # months are approximated as 30 days
+NO_WATERING = 9999  # water_schedule of plants whose watering class is "None"
+
+
+def days_until_water(days_since, water_schedule):
+    return water_schedule - days_since % water_schedule
+
+def days_until_event(days_since, period):
+    """Days from today to the first date_added + k * period (k >= 0) that is after today."""
+    import numpy as np  # deferred like every numpy import here, it is a big part of startup time
+    safe_period = np.maximum(period, 1)
+    return np.where(days_since < 0, -days_since, safe_period - days_since % safe_period)
+
+
+def compute_schedules(date_added, water_schedule, food_schedule, repotting_schedule, today=None):
+    """
+    Takes equal length arrays (dates as ISO strings or datetime64[D], schedules as ints) and returns
+    a dict of arrays: next_water, next_food and next_repotting (datetime64[D], NaT where the schedule
+    is 0), food_event and repotting_event (bool).
+    """
+    import numpy as np
+    today = np.datetime64(today or date.today(), 'D')
+    days_since = (today - np.asarray(date_added, dtype='datetime64[D]')).astype(np.int64)
+    water = np.asarray(water_schedule, dtype=np.int64)
+    food = np.asarray(food_schedule, dtype=np.int64)
+    repotting = np.asarray(repotting_schedule, dtype=np.int64)
+
+    has_water = water != 0
+    next_water = today + days_until_water(days_since, np.where(has_water, water, 1)).astype('timedelta64[D]')
+    next_water[~has_water] = np.datetime64('NaT')
+    days_until_food = days_until_event(days_since, food * MONTH_DAYS)
+    days_until_repotting = days_until_event(days_since, repotting * MONTH_DAYS)
+    next_food = today + days_until_food.astype('timedelta64[D]')
+    next_food[food == 0] = np.datetime64('NaT')
+    next_repotting = today + days_until_repotting.astype('timedelta64[D]')
+    next_repotting[repotting == 0] = np.datetime64('NaT')
+    return {
+        'next_water': next_water, 'next_food': next_food, 'next_repotting': next_repotting,
+        'food_event': (food != 0) & (days_until_food == 1),
+        'repotting_event': (repotting != 0) & (days_until_repotting == 1),
+    }
+
+
+EVENT_KINDS = ('water', 'food', 'repotting')
+
+def events_on(plants, day):
+    """
+    (plant id, kind) of every event falling on day. EventIndex only holds events after its today,
+    so this is how the day's own waterings and events are found: the next event as of the day
+    before is on day exactly when day is one of the plant's event days. Like on the home page, the
+    first of those comes after date_added, the day a plant is added has nothing due.
+    """
+    import numpy as np
+
+    if not plants:
+        return []
+    schedules = compute_schedules(
+        [plant['date_added'] for plant in plants],
+        [int(plant['water_schedule']) for plant in plants],
+        [int(plant['food_schedule']) for plant in plants],
+        [int(plant['repotting_schedule']) for plant in plants],
+        day - timedelta(days=1))
+    day = np.datetime64(day, 'D')
+    added_before = np.asarray([plant['date_added'] for plant in plants], dtype='datetime64[D]') < day
+    events = []
+    for kind in EVENT_KINDS:
+        for row in ((schedules[f'next_{kind}'] == day) & added_before).nonzero()[0].tolist():
+            events.append((plants[row]['id'], kind))
+    return events
+
+class EventIndex:
+    """
+    Next water/food/repotting date of every plant, kept in a date -> events map with the dates in
+    sorted order, so "what is due between two days" is a bisect instead of a pass over the
+    collection. Plants are recomputed only when their schedule fields change (upsert/update/sync)
+    or when their next event has slipped into the past because the day rolled over.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.today = None
+        self.version = None  # storage version the index was last synced against
+        self.plants = {}  # id -> (date_added, water, food, repotting schedule)
+        self.next_dates = {}  # id -> {kind: date or None}
+        self.by_date = {}  # date -> {(id, kind)}
+        self.dates = []  # sorted keys of by_date
+
+    @staticmethod
+    def schedule_key(plant):
+        return (plant['date_added'], int(plant['water_schedule']), int(plant['food_schedule']),
+                int(plant['repotting_schedule']))
+
+    def _unlink(self, plant_id):
+        for kind, due in self.next_dates.pop(plant_id, {}).items():
+            if due is None:
+                continue
+            events = self.by_date[due]
+            events.discard((plant_id, kind))
+            if not events:
+                del self.by_date[due]
+                del self.dates[bisect.bisect_left(self.dates, due)]
+
+    def _compute(self, plant_ids):
+        if not plant_ids:
+            return
+        keys = [self.plants[plant_id] for plant_id in plant_ids]
+        schedules = compute_schedules(*zip(*keys), today=self.today)
+        next_dates = {kind: schedules[f'next_{kind}'].astype(object) for kind in EVENT_KINDS}
+        for position, plant_id in enumerate(plant_ids):
+            self._unlink(plant_id)
+            dates = {kind: next_dates[kind][position] for kind in EVENT_KINDS}
+            self.next_dates[plant_id] = dates
+            for kind, due in dates.items():
+                if due is None:
+                    continue
+                if due not in self.by_date:
+                    self.by_date[due] = set()
+                    bisect.insort(self.dates, due)
+                self.by_date[due].add((plant_id, kind))
+
+    def _roll_forward(self, today):
+        if self.today is not None and today < self.today:
+            stale = list(self.plants)  # clock went backwards, nothing can be trusted
+        else:
+            # Every indexed event is after the day it was computed on; the ones now on or before
+            # today need their next occurrence
+            stale = set()
+            for due in self.dates[:bisect.bisect_right(self.dates, today)]:
+                stale.update(plant_id for plant_id, _ in self.by_date[due])
+        self.today = today
+        self._compute(list(stale))
+
+    def sync(self, plants, today=None, version=None):
+        """Brings the index up to date with plants (the whole collection) as of today."""
+        today = today or date.today()
+        with self.lock:
+            if today != self.today:
+                self._roll_forward(today)
+            if version is not None and version == self.version:
+                return self
+            changed, seen = [], set()
+            for plant in plants:
+                key = self.schedule_key(plant)
+                seen.add(plant['id'])
+                if self.plants.get(plant['id']) != key:
+                    self.plants[plant['id']] = key
+                    changed.append(plant['id'])
+            for plant_id in [plant_id for plant_id in self.plants if plant_id not in seen]:
+                self.remove(plant_id)
+            self._compute(changed)
+            self.version = version
+        return self
+
+    def upsert(self, plant):
+        with self.lock:
+            if self.today is None:
+                self.today = date.today()
+            key = self.schedule_key(plant)
+            if self.plants.get(plant['id']) != key:
+                self.plants[plant['id']] = key
+                self._compute([plant['id']])
+
+    def update(self, plant_id, updates):
+        """Applies a partial edit; plants the index hasn't seen are picked up by the next sync."""
+        with self.lock:
+            if plant_id not in self.plants:
+                return
+            date_added, water, food, repotting = self.plants[plant_id]
+            self.upsert({
+                'id': plant_id,
+                'date_added': updates.get('date_added', date_added),
+                'water_schedule': updates.get('water_schedule', water),
+                'food_schedule': updates.get('food_schedule', food),
+                'repotting_schedule': updates.get('repotting_schedule', repotting),
+            })
+
+    def remove(self, plant_id):
+        with self.lock:
+            self._unlink(plant_id)
+            self.plants.pop(plant_id, None)
+
+    def due_between(self, start, end):
+        """(date, plant id, kind) for every event from start to end inclusive, in date order."""
+        with self.lock:
+            low, high = bisect.bisect_left(self.dates, start), bisect.bisect_right(self.dates, end)
+            return [(due, plant_id, kind) for due in self.dates[low:high]
+                    for plant_id, kind in sorted(self.by_date[due])]
+
+    def next_water(self, plant_id):
+        with self.lock:
+            return self.next_dates.get(plant_id, {}).get('water')
+
+    def next_events(self, plant_id):
+        """{kind: next date or None} of a plant, empty if the index doesn't know it."""
+        with self.lock:
+            return dict(self.next_dates.get(plant_id, {}))
@@ -0,0 +1,119 @@
+"""
+Compact columnar snapshot of a plant collection, the optional alternative to the JSON list in
+plant_data.json (SAKURA_SNAPSHOT_FORMAT=columnar).
+
+Layout: MAGIC, then zlib of a one-line JSON header followed by the raw little-endian columns:
+id (int64), position, date_added as days since 1970-01-01, water/food/repotting schedule (int32),
+then the names as UTF-8 separated by NUL. Any other field (temperature_min/max, ...) is stored
+sparsely in the header, only where it isn't null. Readers tell the formats apart by the magic bytes,
+so a bucket can switch back and forth without converting anything. Reading one builds the
+records.PlantRecord objects the cache keeps straight from the arrays, no plant dicts in between.
+"""
+
+import sys
+import json
+import zlib
+from array import array
+from datetime import date
+
+from records import PlantRecord, PlantCollection
+
+MAGIC = b'SAKURA\x01\n'
+EPOCH = date(1970, 1, 1)
+COLUMNS = [('id', 'q'), ('position', 'i'), ('date_added', 'i'), ('water_schedule', 'i'),
+           ('food_schedule', 'i'), ('repotting_schedule', 'i')]
+CORE_FIELDS = {name for name, _ in COLUMNS} | {'name'}
+
+
+def is_snapshot(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def _as_int(plant, field):
+    value = plant[field]
+    if type(value) is not int:  # "5" or 5.0 would not come back as they went in
+        raise ValueError(f"{field} of plant {plant.get('id')} is not an int: {value!r}")
+    return value
+
+def _to_columns(plants):
+    """(columns, extras) of a collection, see encode_snapshot for what can't be converted."""
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    extras = {}
+    for row, plant in enumerate(plants):
+        for name, _ in COLUMNS:
+            if name == 'date_added':
+                columns[name].append((date.fromisoformat(plant[name]) - EPOCH).days)
+            else:
+                columns[name].append(_as_int(plant, name))
+        if '\0' in plant['name']:
+            raise ValueError(f"name of plant {plant['id']} contains a NUL character")
+        for field, value in plant.items():
+            if field not in CORE_FIELDS:
+                extras.setdefault(field, {})
+                if value is not None:
+                    extras[field][str(row)] = value
+    return columns, extras
+
+def encode_snapshot(plants):
+    """
+    Bytes of the columnar snapshot. Raises ValueError (or KeyError) for collections that can't
+    round-trip through it, e.g. a schedule stored as a string; those have to stay JSON.
+    """
+    columns, extras = _to_columns(plants)
+    names = '\0'.join(plant['name'] for plant in plants).encode('utf-8')
+    header = {'count': len(plants), 'columns': COLUMNS, 'names_bytes': len(names), 'extras': extras}
+    parts = [json.dumps(header, separators=(',', ':')).encode('utf-8'), b'\n']
+    for name, _ in COLUMNS:
+        if sys.byteorder == 'big':
+            columns[name].byteswap()
+        parts.append(columns[name].tobytes())
+    parts.append(names)
+    return MAGIC + zlib.compress(b''.join(parts), 6)
+
+
+class SnapshotColumns:
+    """A decoded snapshot: one array per column, records are only built by to_collection()."""
+    def __init__(self, count, columns, names, extras):
+        self.count = count
+        self.columns = columns  # name -> array
+        self.names = names
+        self.extras = extras  # field -> {row: value}, rows not listed are None
+
+    def to_collection(self):
+        columns = {name: self.columns[name].tolist() for name, _ in COLUMNS}
+        epoch = EPOCH.toordinal()
+        temperature_min = self.extras.get('temperature_min', {})
+        temperature_max = self.extras.get('temperature_max', {})
+        other = [(field, values) for field, values in self.extras.items()
+                 if field not in ('temperature_min', 'temperature_max')]
+        sparse = bool(temperature_min or temperature_max or other)
+        records = []
+        for row, (plant_id, position, day, water, food, repotting, name) in enumerate(zip(
+                columns['id'], columns['position'], columns['date_added'], columns['water_schedule'],
+                columns['food_schedule'], columns['repotting_schedule'], self.names)):
+            if not sparse:
+                records.append(PlantRecord(plant_id, position, name, epoch + day, water, food, repotting))
+                continue
+            key = str(row)
+            records.append(PlantRecord(plant_id, position, name, epoch + day, water, food, repotting,
+                                       temperature_min.get(key), temperature_max.get(key),
+                                       {field: values.get(key) for field, values in other} or None))
+        return PlantCollection(records)
+
+
+def decode_snapshot(data):
+    payload = zlib.decompress(data[len(MAGIC):])
+    header_end = payload.index(b'\n')
+    header = json.loads(payload[:header_end])
+    count, offset = header['count'], header_end + 1
+    columns = {}
+    for name, typecode in header['columns']:
+        column = array(typecode)
+        size = column.itemsize * count
+        column.frombytes(payload[offset:offset + size])
+        if sys.byteorder == 'big':
+            column.byteswap()
+        columns[name] = column
+        offset += size
+    names = payload[offset:offset + header['names_bytes']].decode('utf-8').split('\0') if count else []
+    return SnapshotColumns(count, columns, names, header['extras'])
@@ -0,0 +1,175 @@
+"""
+Watering lookup across the plant APIs, used by get_watering when the offline catalog has no answer.
+
+Perenual and Trefle are asked at the same time and the first usable answer wins, the other one is
+left to finish in the background (its response still lands in the API cache). A provider that hasn't
+answered within SAKURA_LOOKUP_HEDGE_MS gets a second, identical request, so one slow connection or
+stalled server doesn't hold up the add. Under an API call budget (backend.api_limiter, set by bulk
+imports) there is no hedging: a slow answer is then usually a request waiting for its turn.
+
+Both APIs are normalized to the Frequent/Average/Minimum/None classes new_plant_record understands:
+Perenual's watering field as it is, Trefle's soil_humidity (0 = dry, 10 = waterlogged) bucketed.
+Perenual's paid-plan placeholder is not an answer, it is only returned when no provider had anything
+better.
+"""
+
+import os
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from api_cache import normalize_query
+from metrics import registry
+
+PROVIDERS = [name.strip() for name in os.environ.get('SAKURA_LOOKUP_PROVIDERS', 'perenual,trefle').split(',') if name.strip()]
+HEDGE_SECONDS = float(os.environ.get('SAKURA_LOOKUP_HEDGE_MS', '800')) / 1000
+LOOKUP_TIMEOUT = float(os.environ.get('SAKURA_LOOKUP_TIMEOUT', '15'))  # seconds, then whatever came back counts
+LOOKUP_WORKERS = int(os.environ.get('SAKURA_LOOKUP_WORKERS', '16'))
+TREFLE_CANDIDATES = 3  # search results whose details are fetched before Trefle gives up
+MAX_RESULTS = 10  # more matches than this and the query is too vague to pick one
+
+perenual_msg = "Upgrade Plans To Premium/Supreme - https://perenual.com/subscription-api-pricing. I'm sorry"
+WATERING_CLASSES = {'frequent': "Frequent", 'average': "Average", 'minimum': "Minimum", 'none': "None"}
+
+registry.describe('sakura_watering_lookup_seconds', "Time to a watering answer, by the provider that gave it")
+
+
+def normalize_watering(value):
+    """One of the watering classes for a Perenual value, None for anything else."""
+    if not isinstance(value, str):
+        return None
+    return WATERING_CLASSES.get(value.strip().lower())
+
+def soil_humidity_watering(humidity):
+    # Trefle's scale runs from 0 (xerophile) to 10 (subaquatic)
+    if humidity is None:
+        return None
+    if humidity <= 3:
+        return "Minimum"
+    if humidity <= 6:
+        return "Average"
+    return "Frequent"
+
+
+# Each provider function returns (watering class or None, what went wrong)
+def perenual_watering(query, retryable_errors=False):
+    from backend import perenual_query_api
+
+    plants = perenual_query_api(query, retryable_errors)
+    if len(plants) == 0:
+        return None, 'no results'
+    if len(plants) > MAX_RESULTS:
+        return None, f'{len(plants)} results'
+    for plant in plants:
+        watering = normalize_watering(plant.get('watering'))
+        if watering is not None:
+            return watering, None
+    if any(plant.get('watering') == perenual_msg for plant in plants):
+        return None, 'paywalled'
+    return None, 'no watering data'
+
+def trefle_watering(query, retryable_errors=False):
+    from backend import trefle_find_species, trefle_pull_species_id
+
+    data = trefle_find_species(query, retryable_errors)
+    species = (data or {}).get('data') or []
+    if len(species) == 0:
+        return None, 'no results'
+    if len(species) > MAX_RESULTS:
+        return None, f'{len(species)} results'
+    # Search results carry no growth data, the details of the best few candidates do
+    query = normalize_query(query)
+    exact = [result for result in species
+             if query in (normalize_query(result.get('common_name') or ''), normalize_query(result.get('scientific_name') or ''))]
+    candidates = exact + [result for result in species if result not in exact]
+    for result in candidates[:TREFLE_CANDIDATES]:
+        details = trefle_pull_species_id(result['id'], retryable_errors)
+        details = (details or {}).get('data')
+        growth = details.get('growth') if isinstance(details, dict) else None
+        watering = soil_humidity_watering((growth or {}).get('soil_humidity'))
+        if watering is not None:
+            return watering, None
+    return None, 'no watering data'
+
+PROVIDER_LOOKUPS = {'perenual': perenual_watering, 'trefle': trefle_watering}
+
+
+_executor = None
+_executor_lock = threading.Lock()
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=LOOKUP_WORKERS, thread_name_prefix='lookup')
+        return _executor
+
+def find_watering(query, retryable_errors=False, providers=None, hedge=HEDGE_SECONDS, timeout=LOOKUP_TIMEOUT):
+    """
+    Watering class for query from whichever provider answers first. Without an answer: perenual_msg
+    if Perenual only had its paywall placeholder, "NOPE" otherwise. With retryable_errors, a 429/5xx
+    (RetryableAPIError) is raised instead of "NOPE" when it may have hidden the answer.
+    hedge=None turns hedging off, timeout=None waits for every provider (their requests time out).
+    """
+    from backend import api_limiter
+
+    providers = providers or PROVIDERS
+    if api_limiter.get() is not None:
+        # Requests queue for the rate limiter: duplicating them only burns quota, and waiting in
+        # that queue is not the provider being slow
+        hedge, timeout = None, None
+    executor = get_executor()
+    started = time.monotonic()
+    in_flight = {}  # future -> provider
+    attempts = {}
+    outcomes = {}  # provider -> what went wrong, once it is done
+
+    def ask(provider):
+        # Run in a copy of this context, so the provider calls see the caller's api_limiter
+        in_flight[executor.submit(contextvars.copy_context().run, PROVIDER_LOOKUPS[provider], query,
+                                  retryable_errors)] = provider
+        attempts[provider] = attempts.get(provider, 0) + 1
+
+    for provider in providers:
+        ask(provider)
+    while in_flight:
+        elapsed = time.monotonic() - started
+        if timeout is not None and elapsed >= timeout:
+            break
+        unhedged = [provider for provider in set(in_flight.values()) if attempts[provider] == 1] if hedge is not None else []
+        deadline = hedge if unhedged and elapsed < hedge else timeout
+        done, _ = wait(in_flight, timeout=None if deadline is None else deadline - elapsed, return_when=FIRST_COMPLETED)
+        if not done:
+            if unhedged and time.monotonic() - started >= hedge:
+                for provider in unhedged:
+                    print(f"No answer from {provider} for '{query}' after {hedge * 1000:.0f}ms, sending a second request")
+                    ask(provider)
+            continue
+        for future in done:
+            provider = in_flight.pop(future)
+            if provider in outcomes:
+                continue  # the other request for this provider already answered
+            try:
+                watering, problem = future.result()
+            except Exception as e:  # a hedged request may still come through, otherwise this is the outcome
+                watering, problem = None, e
+                if provider in in_flight.values():
+                    continue
+            if watering is not None:
+                registry.observe('sakura_watering_lookup_seconds', (('provider', provider),), time.monotonic() - started)
+                return watering
+            outcomes[provider] = problem
+        # Requests still running for a provider that already answered aren't waited for
+        in_flight = {future: provider for future, provider in in_flight.items() if provider not in outcomes}
+
+    for provider in providers:
+        outcomes.setdefault(provider, 'timed out')
+    print(f"No watering for '{query}': " + ", ".join(f"{provider} {problem}" for provider, problem in outcomes.items()))
+    if outcomes.get('perenual') == 'paywalled':
+        return perenual_msg
+    if retryable_errors:
+        from backend import RetryableAPIError
+        for problem in outcomes.values():
+            if isinstance(problem, RetryableAPIError):
+                raise problem
+    return "NOPE"
@@ -0,0 +1,508 @@
+"""
+Storage engines for the plant collection, selected with the SAKURA_STORAGE environment variable:
+    s3         plant_data.json in the plants-data bucket (default)
+    s3-sharded one object per position under tenant/<SAKURA_TENANT>/ in the same bucket
+    local      plants.json next to the app
+    changelog  append-only change log, see backend.CHANGELOG_DIR
+    sqlite     indexed SQLite database, see SAKURA_SQLITE_PATH
+
+Run `python storage.py migrate --source s3 --target sqlite` to copy a collection between engines.
+"""
+
+import os
+import json
+import sqlite3
+import argparse
+import threading
+
+import backend
+from records import PlantCollection
+
+PLANT_FIELDS = [
+    'id', 'position', 'name', 'date_added', 'water_schedule', 'food_schedule',
+    'repotting_schedule', 'temperature_min', 'temperature_max'
+]
+
+
+def get_next_plant_id(data):
+    return max([plant.get('id', 0) for plant in data] + [0]) + 1
+
+def plant_label(plant):
+    return f"ID: {plant['id']}, {plant['name']}"
+
+
+class PlantStorage:
+    """
+    What the app needs from a storage engine. Only read_all, write_all, add and update are required,
+    the lookups fall back to scanning read_all() and engines with indexes override them.
+    """
+    name = None
+
+    def read_all(self):
+        raise NotImplementedError
+    def write_all(self, plants):
+        raise NotImplementedError
+    def add(self, plant):
+        """Stores plant under a new id, which is set on the dict and returned."""
+        raise NotImplementedError
+    def update(self, plant_id, updates):
+        """Returns False when there is no plant with that id."""
+        raise NotImplementedError
+    def add_many(self, plants):
+        """Stores several new plants in one write where the engine allows it, returns their ids."""
+        return [self.add(plant) for plant in plants]
+    def update_many(self, changes):
+        """Applies {plant id: updates} in one write where the engine allows it, returns the ids found."""
+        return [plant_id for plant_id, updates in changes.items() if self.update(plant_id, updates)]
+
+    def version(self):
+        """
+        Token that changes whenever the stored collection does, as of the last read or write, so
+        derived state (event index, rendered pages) can tell when it is stale. None if unknown.
+        """
+        return None
+
+    def iter_all(self):
+        """Every plant, for exports; engines that can avoid loading the whole collection at once do."""
+        return iter(self.read_all() or [])
+    def collection(self):
+        """
+        The plants as a records.PlantCollection for read-only use, e.g. rendering or queries. The
+        last one is kept and handed out again while the version doesn't change, along with the
+        indexes built on it.
+        """
+        cached = self._collection
+        if self.version_is_current:
+            # version() asks the file or database itself, an unchanged collection isn't even read
+            version = self.version()
+            if version is not None and cached is not None and cached[0] == version:
+                return cached[1]
+            plants = self.read_all() or []
+        else:
+            plants = self.read_all() or []
+            version = self.version()
+        if version is None or cached is None or cached[0] != version:
+            cached = (version, PlantCollection.from_dicts(plants))
+            self._collection = cached
+        return cached[1]
+    _collection = None  # (version, PlantCollection)
+    version_is_current = False  # True when version() reflects writes by other processes without a read
+
+    def get(self, plant_id):
+        plant = self.collection().get(plant_id)
+        return plant.to_dict() if plant is not None else None
+    def search(self, text, limit=50, offset=0):
+        """Plants whose "ID: <id>, <name>" label contains text (any case), in id order, one page of them."""
+        text = text.lower()
+        # Matched on the cached records, only the page that is returned gets copied into dicts
+        matches = [plant for plant in self.collection() if text in plant_label(plant).lower()]
+        matches.sort(key=lambda plant: plant.id)
+        return [plant.to_dict() for plant in matches[offset:offset + limit]]
+    def by_positions(self, positions):
+        collection = self.collection()
+        return {position: [plant.to_dict() for plant in collection.at(position)] for position in positions}
+
+
+class S3Storage(PlantStorage):
+    name = 's3'
+
+    def read_all(self):
+        return backend.read_from_s3()
+    def write_all(self, plants):
+        backend.write_to_s3(plants)
+    def add(self, plant):
+        return backend.add_plant_to_s3(plant)
+    def add_many(self, plants):
+        return backend.add_plants_to_s3(plants)
+    def update(self, plant_id, updates):
+        return backend.update_plant_in_s3(plant_id, updates)
+    def update_many(self, changes):
+        return backend.update_plants_in_s3(changes)
+    def version(self):
+        return backend.s3_data_version()
+    def collection(self):
+        # The cached records themselves, rebuilt only when the document changes
+        return backend.read_s3_collection() or PlantCollection()
+
+
+class ShardedS3Storage(PlantStorage):
+    """
+    One household (tenant) per prefix: tenant/<tenant>/position/<n>.json holds the plants at
+    position n and tenant/<tenant>/manifest.json the next id, the positions in use and the position
+    of every id. Reads fetch only the shards they need, a plant by id is one shard, and every write
+    is a compare-and-swap on a single object, so households, and the positions of one household,
+    are written in parallel. Adds also touch the manifest to allocate ids; moving a plant to another
+    position writes the new shard, then the manifest, then the old shard, so a crash in between can
+    leave it listed twice but never lose it.
+    """
+    name = 's3-sharded'
+
+    def __init__(self, tenant='default'):
+        self.prefix = f"tenant/{tenant}/"
+        self.manifest_key = self.prefix + 'manifest.json'
+
+    def shard_key(self, position):
+        return f"{self.prefix}position/{position}.json"
+    def manifest(self):
+        return backend.read_s3_json(self.manifest_key, {'next_id': 1, 'positions': [], 'locations': {}})[0]
+    def locations(self):
+        """{str(id): position} from the manifest, built once by reading every shard for older manifests."""
+        manifest = self.manifest()
+        if 'locations' in manifest:
+            return manifest['locations']
+        found = {str(plant['id']): position
+                 for position, plants in self.by_positions(manifest['positions']).items() for plant in plants}
+        def backfill(manifest):
+            manifest['locations'] = {**found, **manifest.get('locations', {})}  # adds since the scan win
+        backend.update_s3_json(self.manifest_key, backfill, {'next_id': 1, 'positions': []})
+        return found
+
+    def read_all(self):
+        shards = self.by_positions(self.manifest()['positions'])
+        return sorted((plant for plants in shards.values() for plant in plants), key=lambda plant: plant['id'])
+    def by_positions(self, positions):
+        return {position: backend.read_s3_json(self.shard_key(position), [])[0] for position in positions}
+    def write_all(self, plants):
+        shards = {}
+        for plant in plants:
+            shards.setdefault(plant['position'], []).append(plant)
+        for position in set(self.manifest()['positions']) | set(shards):
+            backend.put_s3_json(self.shard_key(position), shards.get(position, []), conditional=False)
+        backend.put_s3_json(self.manifest_key, {'next_id': get_next_plant_id(plants), 'positions': sorted(shards),
+                                                'locations': {str(plant['id']): plant['position'] for plant in plants}},
+                            conditional=False)
+
+    def register_positions(self, positions, id_count=0, moved=None):
+        """
+        Adds positions to the manifest and reserves id_count ids, returns the first of them. The
+        reserved ids are recorded at positions[i] for the i-th id, moved ({id: position}) as given.
+        """
+        def reserve(manifest):
+            # Older manifests get all their locations at once from locations(), not piecemeal
+            tracked = 'locations' in manifest or (manifest['next_id'] == 1 and not manifest['positions'])
+            first_id = manifest['next_id']
+            manifest['next_id'] += id_count
+            manifest['positions'] = sorted(set(manifest['positions']) | set(positions))
+            if tracked:
+                locations = manifest.setdefault('locations', {})
+                for offset, position in enumerate(positions[:id_count]):
+                    locations[str(first_id + offset)] = position
+                for plant_id, position in (moved or {}).items():
+                    locations[str(plant_id)] = position
+            return first_id
+        return backend.update_s3_json(self.manifest_key, reserve, {'next_id': 1, 'positions': []})
+
+    def add(self, plant):
+        return self.add_many([plant])[0]
+    def add_many(self, plants):
+        first_id = self.register_positions([plant['position'] for plant in plants], len(plants))
+        for offset, plant in enumerate(plants):
+            plant['id'] = first_id + offset
+        for position in {plant['position'] for plant in plants}:
+            new_plants = [dict(plant) for plant in plants if plant['position'] == position]
+            backend.update_s3_json(self.shard_key(position), lambda shard: shard.extend(new_plants), [])
+        return [plant['id'] for plant in plants]
+
+    def find(self, plant_id):
+        """(position, plant) of the plant with that id, or (None, None)."""
+        position = self.locations().get(str(plant_id))
+        if position is None:
+            return None, None  # every id ever allocated is in the manifest
+        for plant in backend.read_s3_json(self.shard_key(position), [])[0]:
+            if plant['id'] == plant_id:
+                return position, plant
+        # Not where the manifest says (a move by another writer in progress), look everywhere
+        for position in self.manifest()['positions']:
+            for plant in backend.read_s3_json(self.shard_key(position), [])[0]:
+                if plant['id'] == plant_id:
+                    return position, plant
+        return None, None
+    def get(self, plant_id):
+        return self.find(plant_id)[1]
+
+    def update(self, plant_id, updates):
+        position, plant = self.find(plant_id)
+        if plant is None:
+            return False
+        new_position = updates.get('position', position)
+        if new_position == position:
+            def apply(shard):
+                for stored in shard:
+                    if stored['id'] == plant_id:
+                        stored.update(updates)
+                        return True
+                return False
+            return backend.update_s3_json(self.shard_key(position), apply, [])
+
+        moved = {**plant, **updates}
+        def insert(shard):
+            shard[:] = [stored for stored in shard if stored['id'] != plant_id] + [moved]
+        def remove(shard):
+            shard[:] = [stored for stored in shard if stored['id'] != plant_id]
+        backend.update_s3_json(self.shard_key(new_position), insert, [])
+        self.register_positions([new_position], moved={plant_id: new_position})
+        backend.update_s3_json(self.shard_key(position), remove, [])
+        return True
+    def update_many(self, changes):
+        # One write per shard touched; plants moving to another position go through update()
+        locations = self.locations()
+        shard_ids = {}  # position -> ids in that shard, for the shards the manifest points at
+        for plant_id in changes:
+            position = locations.get(str(plant_id))
+            if position is not None and position not in shard_ids:
+                shard_ids[position] = {plant['id'] for plant in backend.read_s3_json(self.shard_key(position), [])[0]}
+        positions = {}
+        for plant_id in changes:
+            position = locations.get(str(plant_id))
+            if position is not None and plant_id not in shard_ids[position]:
+                position = self.find(plant_id)[0]
+            if position is not None:
+                positions[plant_id] = position
+        updated, in_place = [], {}
+        for plant_id, position in positions.items():
+            if changes[plant_id].get('position', position) == position:
+                in_place.setdefault(position, {})[plant_id] = changes[plant_id]
+            elif self.update(plant_id, changes[plant_id]):
+                updated.append(plant_id)
+        for position, shard_changes in in_place.items():
+            def apply(shard):
+                found = []
+                for stored in shard:
+                    if stored['id'] in shard_changes:
+                        stored.update(shard_changes[stored['id']])
+                        found.append(stored['id'])
+                return found
+            updated += backend.update_s3_json(self.shard_key(position), apply, [])
+        return updated
+
+    def version(self):
+        return backend.s3_objects_version(self.prefix)
+
+
+class LocalJsonStorage(PlantStorage):
+    name = 'local'
+    version_is_current = True
+
+    def __init__(self, filename='plants.json'):
+        self.filename = filename
+        self.lock = threading.Lock()  # single process only, like the file itself
+
+    def read_all(self):
+        return backend.read_local_plant_data(self.filename)
+    def write_all(self, plants):
+        with open(self.filename, 'w') as file:
+            json.dump({'plants': plants}, file, indent=4)
+    def add(self, plant):
+        return self.add_many([plant])[0]
+    def add_many(self, plants):
+        with self.lock:
+            plants_data = self.read_all()
+            for plant in plants:
+                plant['id'] = get_next_plant_id(plants_data)
+                plants_data.append(plant)
+            self.write_all(plants_data)
+        return [plant['id'] for plant in plants]
+    def update(self, plant_id, updates):
+        return bool(self.update_many({plant_id: updates}))
+    def update_many(self, changes):
+        with self.lock:
+            plants_data = self.read_all()
+            updated = []
+            for plant in plants_data:
+                if plant['id'] in changes:
+                    plant.update(changes[plant['id']])
+                    updated.append(plant['id'])
+            if updated:
+                self.write_all(plants_data)
+        return updated
+    def version(self):
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+class ChangeLogStorage(PlantStorage):
+    name = 'changelog'
+
+    def __init__(self, directory=backend.CHANGELOG_DIR):
+        self.directory = directory
+
+    def read_all(self):
+        return backend.read_changelog_plant_data(self.directory)
+    def write_all(self, plants):
+        backend.changelog_replace_plants(plants, self.directory)
+    def add(self, plant):
+        return backend.changelog_add_plant(plant, self.directory)
+    def add_many(self, plants):
+        return backend.changelog_add_plants(plants, self.directory)
+    def update(self, plant_id, updates):
+        return backend.changelog_update_plant(plant_id, updates, self.directory)
+    def update_many(self, changes):
+        return backend.changelog_update_plants(changes, self.directory)
+    def version(self):
+        return backend.changelog_version(self.directory)
+
+
+class SQLiteStorage(PlantStorage):
+    """One row per plant; id is the primary key and position has its own index."""
+    name = 'sqlite'
+    version_is_current = True
+    schema = """
+        CREATE TABLE IF NOT EXISTS plants (
+            id INTEGER PRIMARY KEY,
+            position INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            date_added TEXT NOT NULL,
+            water_schedule INTEGER NOT NULL,
+            food_schedule INTEGER NOT NULL,
+            repotting_schedule INTEGER NOT NULL,
+            temperature_min TEXT,
+            temperature_max TEXT
+        );
+        CREATE INDEX IF NOT EXISTS plants_position ON plants (position);
+        -- Bumped by every change, from any connection or process, see version()
+        CREATE TABLE IF NOT EXISTS plants_version (version INTEGER NOT NULL);
+        INSERT INTO plants_version SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM plants_version);
+        CREATE TRIGGER IF NOT EXISTS plants_inserted AFTER INSERT ON plants
+            BEGIN UPDATE plants_version SET version = version + 1; END;
+        CREATE TRIGGER IF NOT EXISTS plants_updated AFTER UPDATE ON plants
+            BEGIN UPDATE plants_version SET version = version + 1; END;
+        CREATE TRIGGER IF NOT EXISTS plants_deleted AFTER DELETE ON plants
+            BEGIN UPDATE plants_version SET version = version + 1; END;
+    """
+
+    def __init__(self, path='plants.db'):
+        self.path = path
+        self.local = threading.local()  # sqlite3 connections can't be shared between threads
+        self.connection().executescript(self.schema)
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = sqlite3.Row
+            connection.execute('PRAGMA journal_mode=WAL')  # readers don't block the writer
+            self.local.connection = connection
+        return self.local.connection
+
+    def query(self, where='', params=(), limit=-1, offset=0):
+        rows = self.connection().execute(
+            f"SELECT {', '.join(PLANT_FIELDS)} FROM plants {where} ORDER BY id LIMIT ? OFFSET ?",
+            tuple(params) + (limit, offset))
+        return [dict(row) for row in rows]
+
+    def read_all(self):
+        return self.query()
+    def iter_all(self, batch_size=1000):
+        # Own connection: the generator can outlive a request and a thread's shared connection
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.row_factory = sqlite3.Row
+        try:
+            cursor = connection.execute(f"SELECT {', '.join(PLANT_FIELDS)} FROM plants ORDER BY id")
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield dict(row)
+        finally:
+            connection.close()
+    def write_all(self, plants):
+        with self.connection() as connection:
+            connection.execute('DELETE FROM plants')
+            connection.executemany(
+                f"INSERT INTO plants ({', '.join(PLANT_FIELDS)}) VALUES ({', '.join('?' * len(PLANT_FIELDS))})",
+                [[plant.get(field) for field in PLANT_FIELDS] for plant in plants])
+    def add(self, plant):
+        return self.add_many([plant])[0]
+    def add_many(self, plants):
+        fields = [field for field in PLANT_FIELDS if field != 'id']
+        with self.connection() as connection:  # one transaction for all of them
+            for plant in plants:
+                cursor = connection.execute(
+                    f"INSERT INTO plants ({', '.join(fields)}) VALUES ({', '.join('?' * len(fields))})",
+                    [plant.get(field) for field in fields])
+                plant['id'] = cursor.lastrowid
+        return [plant['id'] for plant in plants]
+    def update(self, plant_id, updates):
+        return bool(self.update_many({plant_id: updates}))
+    def update_many(self, changes):
+        updated = []
+        with self.connection() as connection:  # one transaction for all of them
+            for plant_id, updates in changes.items():
+                updates = {field: value for field, value in updates.items() if field in PLANT_FIELDS and field != 'id'}
+                if not updates:
+                    found = connection.execute('SELECT 1 FROM plants WHERE id = ?', (plant_id,)).fetchone()
+                    if found:
+                        updated.append(plant_id)
+                    continue
+                cursor = connection.execute(
+                    f"UPDATE plants SET {', '.join(f'{field} = ?' for field in updates)} WHERE id = ?",
+                    list(updates.values()) + [plant_id])
+                if cursor.rowcount > 0:
+                    updated.append(plant_id)
+        return updated
+
+    def version(self):
+        return self.connection().execute('SELECT version FROM plants_version').fetchone()[0]
+
+    def get(self, plant_id):
+        plants = self.query('WHERE id = ?', (plant_id,))
+        return plants[0] if plants else None
+    def by_positions(self, positions):
+        return {position: self.query('WHERE position = ?', (position,)) for position in positions}
+    def search(self, text, limit=50, offset=0):
+        pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        return self.query("WHERE ('ID: ' || id || ', ' || name) LIKE ? ESCAPE '\\'", (pattern,), limit, offset)
+
+
+ENGINES = ['s3', 's3-sharded', 'local', 'changelog', 'sqlite']
+
+def create_storage(name):
+    if name == 's3':
+        return S3Storage()
+    if name == 's3-sharded':
+        return ShardedS3Storage(os.environ.get('SAKURA_TENANT', 'default'))
+    if name == 'local':
+        return LocalJsonStorage(os.environ.get('SAKURA_LOCAL_PATH', 'plants.json'))
+    if name == 'changelog':
+        return ChangeLogStorage()
+    if name == 'sqlite':
+        return SQLiteStorage(os.environ.get('SAKURA_SQLITE_PATH', 'plants.db'))
+    raise ValueError(f"Unknown storage engine: {name}")
+
+_storage = None
+def get_storage():
+    """The engine configured by SAKURA_STORAGE, created on first use."""
+    global _storage
+    if _storage is None:
+        storage = create_storage(os.environ.get('SAKURA_STORAGE', 's3'))
+        write_behind = float(os.environ.get('SAKURA_WRITE_BEHIND', '0'))
+        if write_behind > 0:
+            from write_behind import WriteBehindStorage  # imports this module
+            storage = WriteBehindStorage(storage, write_behind)
+        _storage = storage
+    return _storage
+
+
+def migrate(source, target):
+    """Copies every plant, ids included, from one engine into another and returns the count."""
+    plants = source.read_all()
+    if plants is None:
+        raise RuntimeError(f"Could not read plants from {source.name} storage")
+    target.write_all(plants)
+    return len(plants)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sakura plant storage tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    migrate_parser = commands.add_parser('migrate', help="copy the plant collection between storage engines")
+    migrate_parser.add_argument('--source', default='s3', choices=ENGINES)
+    migrate_parser.add_argument('--target', default='sqlite', choices=ENGINES)
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        count = migrate(create_storage(args.source), create_storage(args.target))
+        print(f"Copied {count} plants from {args.source} to {args.target} storage")
@@ -0,0 +1,181 @@
+"""
+Write-behind mode for plant edits (SAKURA_WRITE_BEHIND=<seconds>).
+
+WriteBehindStorage wraps the configured engine: update() records the edit in a local journal
+(fsynced, so it survives the process dying), merges it into the pending edits of that plant and
+returns right away. Every few seconds, and at shutdown, the pending edits go to the engine in one
+update_many() call, so a burst of dashboard edits becomes one S3 upload instead of one per click.
+Reads in this process see pending edits, also while their flush is under way; other processes see
+them after the flush. Journals left by a crash are replayed into the next flush when the app starts
+again.
+"""
+
+import os
+import glob
+import json
+import atexit
+import threading
+
+from storage import PlantStorage
+
+JOURNAL_PATH = os.environ.get('SAKURA_WRITE_BEHIND_JOURNAL', 'write_behind.jsonl')
+
+
+class WriteBehindStorage(PlantStorage):
+    def __init__(self, inner, interval, journal_path=JOURNAL_PATH):
+        self.inner = inner
+        self.name = inner.name
+        self.interval = interval
+        self.journal_path = journal_path
+        self.lock = threading.RLock()
+        self.flush_lock = threading.Lock()  # one flush at a time, edits keep coming in meanwhile
+        self.pending = {}  # plant id -> merged updates not yet in the engine
+        self.flushing = {}  # the batch update_many is sending right now, still read from here until it lands
+        self.edits = 0  # bumped by every buffered edit, part of version()
+        self.journal = None
+        self.replay()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.flush_periodically, name='write-behind', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    # Journal: one {"id", "updates"} line per edit. A flush renames it to <path>.<n>.flushing first
+    # and deletes that file only once the engine has the edits.
+    def flushing_paths(self):
+        return sorted(glob.glob(f"{glob.escape(self.journal_path)}.*.flushing"),
+                      key=lambda path: int(path.rsplit('.', 2)[-2]))
+
+    def replay(self):
+        for path in self.flushing_paths() + [self.journal_path]:
+            if not os.path.exists(path):
+                continue
+            with open(path, 'r') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn last line of a crash, that edit was never acknowledged
+                    self.pending.setdefault(entry['id'], {}).update(entry['updates'])
+        if self.pending:
+            print(f"Replaying {len(self.pending)} unflushed plant edits from {self.journal_path}")
+
+    def log(self, plant_id, updates):
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'a')
+        self.journal.write(json.dumps({'id': plant_id, 'updates': updates}) + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+
+    def flush(self):
+        """Sends every pending edit to the engine in one update_many, returns how many plants it touched."""
+        with self.flush_lock:
+            with self.lock:
+                changes, self.pending = self.pending, {}
+                self.flushing = changes
+                if self.journal is not None:
+                    self.journal.close()
+                    self.journal = None
+                rotated = None
+                if os.path.exists(self.journal_path):
+                    numbers = [int(path.rsplit('.', 2)[-2]) for path in self.flushing_paths()]
+                    rotated = f"{self.journal_path}.{max(numbers + [0]) + 1}.flushing"
+                    os.replace(self.journal_path, rotated)
+            if not changes:
+                return 0
+            try:
+                self.inner.update_many(changes)
+            except Exception:
+                with self.lock:  # edits made since keep precedence over the ones that failed
+                    for plant_id, updates in changes.items():
+                        self.pending[plant_id] = {**updates, **self.pending.get(plant_id, {})}
+                    self.flushing = {}
+                raise
+            with self.lock:
+                self.flushing = {}
+            # Everything up to this rotation is in the engine now, older leftovers included
+            for path in self.flushing_paths():
+                if rotated is None or int(path.rsplit('.', 2)[-2]) <= int(rotated.rsplit('.', 2)[-2]):
+                    os.remove(path)
+            return len(changes)
+
+    def flush_periodically(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.flush()
+            except Exception as e:  # pending edits stay journaled, the next tick tries again
+                print(f"Write-behind flush failed: {e}")
+
+    def close(self):
+        self.stopped.set()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Write-behind flush at shutdown failed, edits stay in {self.journal_path}: {e}")
+
+    def buffered(self):
+        """Whether the engine is missing edits reads have to see, pending or in flight."""
+        with self.lock:
+            return bool(self.pending or self.flushing)
+
+    def overlay(self, plant):
+        if plant is None or (plant['id'] not in self.pending and plant['id'] not in self.flushing):
+            return plant
+        return {**plant, **self.flushing.get(plant['id'], {}), **self.pending.get(plant['id'], {})}
+
+    # Edits are buffered; adds and full rewrites go straight through after a flush, so the engine
+    # allocates ids and sees edits in the order they were made.
+    def update(self, plant_id, updates):
+        if plant_id not in self.pending and plant_id not in self.flushing and self.inner.get(plant_id) is None:
+            return False
+        with self.lock:
+            self.log(plant_id, updates)
+            self.pending.setdefault(plant_id, {}).update(updates)
+            self.edits += 1
+        return True
+    def update_many(self, changes):
+        return [plant_id for plant_id, updates in changes.items() if self.update(plant_id, updates)]
+    def add(self, plant):
+        self.flush()
+        return self.inner.add(plant)
+    def add_many(self, plants):
+        self.flush()
+        return self.inner.add_many(plants)
+    def write_all(self, plants):
+        with self.flush_lock, self.lock:
+            # The new collection replaces whatever was pending
+            self.pending = {}
+            self.flushing = {}
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            for path in self.flushing_paths() + [self.journal_path]:
+                if os.path.exists(path):
+                    os.remove(path)
+            self.inner.write_all(plants)
+
+    def read_all(self):
+        plants = self.inner.read_all()
+        with self.lock:
+            return None if plants is None else [self.overlay(plant) for plant in plants]
+    def version(self):
+        version = self.inner.version()
+        with self.lock:
+            if not (self.pending or self.flushing):
+                return version
+            return f"{version}+{self.edits}"
+    def get(self, plant_id):
+        plant = self.inner.get(plant_id)
+        with self.lock:
+            return self.overlay(plant)
+    def search(self, text, limit=50, offset=0):
+        if not self.buffered():
+            return self.inner.search(text, limit, offset)
+        return PlantStorage.search(self, text, limit, offset)  # pending renames must match too
+    def collection(self):
+        if not self.buffered():
+            return self.inner.collection()
+        return PlantStorage.collection(self)
+    def by_positions(self, positions):
+        if not self.buffered():
+            return self.inner.by_positions(positions)
+        return PlantStorage.by_positions(self, positions)  # pending edits may move plants